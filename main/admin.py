@@ -1,7 +1,26 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.utils import timezone
 from main.models import User, Task, Team
+from main.team_formation import form_teams, TeamFormationError
+
+
+@admin.action(description="Form balanced teams from the selected users")
+def form_teams_action(modeladmin, request, queryset):
+    prefix = timezone.now().strftime("T%m%d%H%M")
+    try:
+        teams, report = form_teams(queryset.filter(is_superuser=False), 5, prefix, request.user)
+    except TeamFormationError as error:
+        modeladmin.message_user(request, str(error), messages.ERROR)
+        return
+    modeladmin.message_user(request, f"{len(teams)} teams created in {report['solve_time']:.3f}s "
+                                     f"(type diversity {report['type_diversity']:.2f}, "
+                                     f"score spread {report['score_mean_std']:.2f})", messages.SUCCESS)
+
+
+@admin.register(User)
+class UserAdmin(admin.ModelAdmin):
+    actions = [form_teams_action]
+
 
-admin.site.register(User)
 admin.site.register(Task)
 admin.site.register(Team)
-
@@ -1,4 +1,6 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_migrate
 
 
 class MainConfig(AppConfig):
@@ -7,3 +9,26 @@ class MainConfig(AppConfig):
 
     def ready(self):
         import main.signals
+        from .search import create_search_indexes
+        from .learning_model.matchmaker import registry
+        from .learning_model.executor import prediction_executor
+        from .push import push_queue
+        from .presence import presence
+        from .leaderboards import leaderboards
+
+        registry.mmap_mode = settings.MATCHMAKER["MMAP_MODE"]
+        registry.cache_size = settings.MATCHMAKER["CACHE_SIZE"]
+        registry.reload_interval = settings.MATCHMAKER["RELOAD_INTERVAL"]
+        prediction_executor.kind = settings.MATCHMAKER["EXECUTOR"]
+        prediction_executor.max_workers = settings.MATCHMAKER["WORKERS"]
+        prediction_executor.max_queue = settings.MATCHMAKER["MAX_QUEUE"]
+        prediction_executor.timeout = settings.MATCHMAKER["TIMEOUT"]
+        push_queue.window = settings.PUSH["WINDOW"]
+        push_queue.max_batch = settings.PUSH["MAX_BATCH"]
+        presence.ttl = settings.PRESENCE["TTL"]
+        presence.interval = settings.PRESENCE["INTERVAL"]
+        leaderboards.key_prefix = settings.LEADERBOARDS["KEY_PREFIX"]
+        post_migrate.connect(create_search_indexes, sender=self)
+
+        if settings.MATCHMAKER["PRELOAD"]:
+            registry.warm_up()
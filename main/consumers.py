@@ -1,24 +1,333 @@
-from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.generic.websocket import AsyncWebsocketConsumer, AsyncJsonWebsocketConsumer
+from channels.db import database_sync_to_async
+from channels.consumer import get_handler_name
+from asgiref.sync import sync_to_async
+from urllib.parse import parse_qs
 import json
 
+from .utils import get_notification_model
+from .streams import notifications_group, team_group, invitations_group, presence_group, user_group
+from .presence import presence
 
 
-class NotificationConsumer(AsyncWebsocketConsumer):
+
+class NotificationReplayMixin:
+    """
+    This mixin sends the notifications a reconnecting client missed (after its last seen notification id),
+    read from the database in id-ordered chunks, and then skips those if they are pushed again live.
+    Consumers send each notification through send_notification_data().
+    """
+
+    REPLAY_CHUNK_SIZE = 100
+    MAX_REPLAY = 1000
+
+    @database_sync_to_async
+    def missed_notifications(self, user_id, after_id, limit):
+        Notification = get_notification_model()
+        return list(Notification.objects.filter(user_id=user_id, id__gt=after_id).order_by("id")
+                    .values("id", "message", "created_at")[:limit])
+
+    async def replay(self, user_id, last_seen):
+        """
+        This method sends the notifications after last_seen, REPLAY_CHUNK_SIZE rows per query.
+        Each query runs in a worker thread, so a long backlog doesn't hold up the event loop.
+        Past MAX_REPLAY notifications the client is told to reload the list instead.
+        It returns the closing replay message.
+        """
+        replayed_up_to = last_seen
+        while len(self.replayed_ids) < self.MAX_REPLAY:
+            chunk = await self.missed_notifications(user_id, replayed_up_to,
+                                                    min(self.REPLAY_CHUNK_SIZE, self.MAX_REPLAY - len(self.replayed_ids)))
+            for notification in chunk:
+                await self.send_notification_data({
+                    "id": notification["id"], "message": notification["message"],
+                    "created_at": notification["created_at"].isoformat(), "replayed": True,
+                })
+            self.replayed_ids.update(notification["id"] for notification in chunk)
+            if chunk:
+                replayed_up_to = chunk[-1]["id"]
+            if len(chunk) < self.REPLAY_CHUNK_SIZE:
+                break
+
+        truncated = len(self.replayed_ids) >= self.MAX_REPLAY
+        return {"replay_complete": True, "last_seen": replayed_up_to, "truncated": truncated}
+
+    async def send_notification(self, event):
+        # A notification committed during the replay can be both replayed and pushed, it is only sent once.
+        if event.get("id") in self.replayed_ids:
+            return
+        await self.send_notification_data({"id": event.get("id"), "message": event["message"],
+                                           "created_at": event.get("created_at")})
+
+
+
+class PushBatchMixin:
+    """
+    This mixin handles the "push_batch" events of the push queue: each batched event goes to its usual handler,
+    and the frames they produce are sent as one. Handlers send their frames through send_frame().
+    Consumers define send_frame_data() and batch_frame().
+    """
+
+    batched_frames = None
+
+    async def send_frame(self, data):
+        if self.batched_frames is not None:
+            self.batched_frames.append(data)
+        else:
+            await self.send_frame_data(data)
+
+    async def push_batch(self, event):
+        self.batched_frames = []
+        try:
+            for batched_event in event["events"]:
+                await getattr(self, get_handler_name(batched_event))(batched_event)
+        finally:
+            frames, self.batched_frames = self.batched_frames, None
+        if len(frames) == 1:
+            await self.send_frame_data(frames[0])
+        elif frames:
+            await self.send_frame_data(self.batch_frame(frames))
+
+
+
+class TeamGroupsMixin:
+    """
+    This mixin puts the socket in the groups of its user's teams on connect, so one group_send reaches
+    every connected member. The user's own group tells it when the user joins or leaves a team.
+    Consumers join and leave a team through join_team() and leave_team().
+    """
+
+    member_team_ids = frozenset()
+
+    @database_sync_to_async
+    def user_team_ids(self, user):
+        return list(user.teams.values_list("id", flat=True))
+
+    async def join_team_groups(self, user):
+        # The user's group is joined first, so a membership change made while the teams are read still arrives.
+        await self.channel_layer.group_add(user_group(user.id), self.channel_name)
+        self.member_team_ids = set(await self.user_team_ids(user))
+        for team_id in self.member_team_ids:
+            await self.join_team(team_id)
+
+    async def leave_user_group(self, user):
+        await self.channel_layer.group_discard(user_group(user.id), self.channel_name)
+
+    async def team_membership(self, event):
+        if event["joined"]:
+            self.member_team_ids.add(event["team_id"])
+            await self.join_team(event["team_id"])
+        else:
+            self.member_team_ids.discard(event["team_id"])
+            await self.leave_team(event["team_id"])
+
+
+
+class PresenceMixin:
+    """
+    This mixin keeps the socket's user online while it is open. Clients send a heartbeat more often than
+    every PRESENCE["TTL"] seconds, a socket that stops doing so no longer counts.
+    Users coming online or going offline are announced to the presence streams of their teams,
+    the ones whose heartbeats stopped by the sweep of the processes with open sockets.
+    """
+
+    async def presence_touch(self, user):
+        if await sync_to_async(presence.touch, thread_sensitive=False)(user.id, self.channel_name):
+            presence.announce(user.id, self.member_team_ids, online=True)
+        presence.start_sweeping()
+
+    async def presence_leave(self, user):
+        if await sync_to_async(presence.leave, thread_sensitive=False)(user.id, self.channel_name):
+            presence.announce(user.id, self.member_team_ids, online=False)
+
+
+
+class NotificationConsumer(PushBatchMixin, PresenceMixin, TeamGroupsMixin, NotificationReplayMixin, AsyncWebsocketConsumer):
+    """
+    This consumer relays a user's notifications. A client that reconnects with "?last_seen=<notification id>"
+    first gets the notifications it missed, then the live ones. Batched pushes arrive as {"batch": [...]}.
+    Clients keep their user online by sending {"type": "heartbeat"}.
+    """
+
     async def connect(self):
         self.username = self.scope['url_route']['kwargs']['username']
-        self.group_name = f'notifications_{self.username}'
+        self.group_name = notifications_group(self.username)
+        self.replayed_ids = set()
 
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated or user.username != self.username:
+            await self.close()
+            return
+
+        # Joining the group before the replay means nothing pushed meanwhile is missed,
+        # live events are only handled once connect() returns and the ones already replayed are skipped.
         await self.channel_layer.group_add(self.group_name, self.channel_name)
-        print("WS CONNECT", self.scope['url_route']['kwargs'])
+        await self.join_team_groups(user)
         await self.accept()
+        await self.presence_touch(user)
+
+        last_seen = parse_qs(self.scope.get("query_string", b"").decode()).get("last_seen", [None])[0]
+        if last_seen is not None and last_seen.isdigit():
+            await self.send(text_data=json.dumps(await self.replay(user.id, int(last_seen))))
 
     async def disconnect(self, code):
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated or user.username != self.username:
+            return
+        await self.presence_leave(user)
+        for team_id in self.member_team_ids:
+            await self.channel_layer.group_discard(team_group(team_id), self.channel_name)
+        await self.leave_user_group(user)
 
     async def receive(self, text_data):
         data = json.loads(text_data)
+        if isinstance(data, dict) and data.get("type") == "heartbeat":
+            await self.presence_touch(self.scope["user"])
+            return
         await self.send(text_data=json.dumps({"message": f"Received {data}"}))
 
-    async def send_notification(self, event):
-        message = event['message']
-        await self.send(text_data=json.dumps({"message": message}))
+    async def send_frame_data(self, data):
+        await self.send(text_data=json.dumps(data))
+
+    def batch_frame(self, frames):
+        return {"batch": frames}
+
+    async def send_notification_data(self, data):
+        await self.send_frame(data)
+
+    async def send_unread_count(self, event):
+        await self.send_frame({"unread_count": event["count"]})
+
+    async def join_team(self, team_id):
+        await self.channel_layer.group_add(team_group(team_id), self.channel_name)
+
+    async def leave_team(self, team_id):
+        await self.channel_layer.group_discard(team_group(team_id), self.channel_name)
+
+    async def stream_event(self, event):
+        # Team events are shown like notifications, except the ones about tasks the user created.
+        task = event["payload"].get("task", {})
+        if event["payload"].get("event") == "task_created" and task.get("created_by_id") == self.scope["user"].id:
+            return
+        await self.send_frame({"team_id": event.get("team_id"), **event["payload"]})
+
+
+
+class StreamConsumer(PushBatchMixin, PresenceMixin, TeamGroupsMixin, NotificationReplayMixin, AsyncJsonWebsocketConsumer):
+    """
+    This consumer multiplexes several streams over one authenticated socket. Clients send
+        {"action": "subscribe" | "unsubscribe", "stream": <name>, "team_id": <id, for team streams>}
+    ("last_seen" can be added to a notifications subscription to replay what was missed) and receive
+        {"type": "event", "stream": <name>, "team_id": <id or None>, "payload": {...}}
+    for every event of the streams they are subscribed to, each backed by one channel layer group.
+    The team streams of the user's teams are subscribed to on connect and follow membership changes.
+    Batched pushes arrive as {"type": "batch", "events": [...]}.
+    Clients keep their user online by sending {"action": "heartbeat"}.
+    """
+
+    MAX_SUBSCRIPTIONS = 50
+
+    # stream name: (needs a team_id, group name of the stream for the user and team_id)
+    STREAMS = {
+        "notifications": (False, lambda user, team_id: notifications_group(user.username)),
+        "invitations": (False, lambda user, team_id: invitations_group(user.id)),
+        "team": (True, lambda user, team_id: team_group(team_id)),
+        "presence": (True, lambda user, team_id: presence_group(team_id)),
+    }
+
+    async def connect(self):
+        self.user = self.scope.get("user")
+        self.subscriptions = {}
+        self.replayed_ids = set()
+        if self.user is None or not self.user.is_authenticated:
+            await self.close()
+            return
+        await self.accept()
+        await self.join_team_groups(self.user)
+        await self.presence_touch(self.user)
+
+    async def disconnect(self, code):
+        for group_name in self.subscriptions.values():
+            await self.channel_layer.group_discard(group_name, self.channel_name)
+        if self.user is not None and self.user.is_authenticated:
+            await self.presence_leave(self.user)
+            await self.leave_user_group(self.user)
+
+
+    @database_sync_to_async
+    def is_member(self, team_id):
+        return self.user.teams.filter(id=team_id).exists()
+
+    async def error(self, message, content=None):
+        await self.send_frame({"type": "error", "message": message, "request": content})
+
+    async def receive_json(self, content, **kwargs):
+        if not isinstance(content, dict):
+            return await self.error("Messages must be JSON objects!")
+
+        action, stream = content.get("action"), content.get("stream")
+        if action == "heartbeat":
+            return await self.presence_touch(self.user)
+        if action not in ("subscribe", "unsubscribe"):
+            return await self.error("Unknown action!", content)
+        if stream not in self.STREAMS:
+            return await self.error("Unknown stream!", content)
+
+        needs_team, group_for = self.STREAMS[stream]
+        team_id = content.get("team_id") if needs_team else None
+        if needs_team and not isinstance(team_id, int):
+            return await self.error("This stream needs a team_id!", content)
+        key = (stream, team_id)
+
+        if action == "unsubscribe":
+            group_name = self.subscriptions.pop(key, None)
+            if group_name:
+                await self.channel_layer.group_discard(group_name, self.channel_name)
+            return await self.send_frame({"type": "unsubscribed", "stream": stream, "team_id": team_id})
+
+        if key not in self.subscriptions:
+            if len(self.subscriptions) >= self.MAX_SUBSCRIPTIONS:
+                return await self.error("Too many subscriptions!", content)
+            if needs_team and not await self.is_member(team_id):
+                return await self.error("You are not a member of this team!", content)
+            self.subscriptions[key] = group_for(self.user, team_id)
+            await self.channel_layer.group_add(self.subscriptions[key], self.channel_name)
+        await self.send_frame({"type": "subscribed", "stream": stream, "team_id": team_id})
+
+        last_seen = content.get("last_seen")
+        if stream == "notifications" and isinstance(last_seen, int):
+            await self.send_stream("notifications", await self.replay(self.user.id, last_seen))
+
+
+    async def join_team(self, team_id):
+        if ("team", team_id) not in self.subscriptions:
+            self.subscriptions[("team", team_id)] = team_group(team_id)
+            await self.channel_layer.group_add(team_group(team_id), self.channel_name)
+            await self.send_frame({"type": "subscribed", "stream": "team", "team_id": team_id})
+
+    async def leave_team(self, team_id):
+        for stream in ("team", "presence"):
+            group_name = self.subscriptions.pop((stream, team_id), None)
+            if group_name:
+                await self.channel_layer.group_discard(group_name, self.channel_name)
+                await self.send_frame({"type": "unsubscribed", "stream": stream, "team_id": team_id})
+
+
+    async def send_frame_data(self, data):
+        await self.send_json(data)
+
+    def batch_frame(self, frames):
+        return {"type": "batch", "events": frames}
+
+    async def send_stream(self, stream, payload, team_id=None):
+        await self.send_frame({"type": "event", "stream": stream, "team_id": team_id, "payload": payload})
+
+    async def send_notification_data(self, data):
+        await self.send_stream("notifications", data)
+
+    async def send_unread_count(self, event):
+        await self.send_stream("notifications", {"unread_count": event["count"]})
+
+    async def stream_event(self, event):
+        await self.send_stream(event["stream"], event["payload"], event.get("team_id"))
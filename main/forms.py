@@ -2,7 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import get_user_model
 from .models import Team, Task
-from .learning_model.matchmaker import predict_user_type
+from .learning_model.executor import prediction_executor, PredictionUnavailable
 
 
 User = get_user_model()
@@ -44,7 +44,10 @@ class MySignUpForm(UserCreationForm):
         type_value = self.cleaned_data["type"]
         if type_value == "AI-PRED":
             skills = self.cleaned_data["skills"]
-            type_value = predict_user_type(skills).upper()
+            try:
+                type_value = prediction_executor.predict(skills).upper()
+            except PredictionUnavailable:
+                raise forms.ValidationError("We couldn't predict your type right now, please choose it yourself!")
         return type_value
 
 
@@ -6,18 +6,28 @@ from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.filters import OrderingFilter
 from django.shortcuts import get_object_or_404
-from django.db import transaction
-from django.db.models import Q
+from django.db import transaction, IntegrityError
+from django.db.models import Q, F
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import LeaderShipInvitation, Team, Invitation, User, Task, Notification
+from .models import LeaderShipInvitation, Team, Invitation, User, Task, Notification, UserRating
 
 from .serializers import (
     TeamSerializer, InvitationSerializer, UserSerializer,
     TaskSerializer, NotificationSerializer, ExtendDeadlineSerializer,
-    SendTeamInvitationSerializer, RemoveMemberSerializer
+    SendTeamInvitationSerializer, RemoveMemberSerializer, PredictUserTypesSerializer,
+    RecommendTeammatesSerializer, UserSearchSerializer, BulkRatingSerializer,
+    LeaderboardSerializer, MarkNotificationsAsReadSerializer, DeleteReadNotificationsSerializer
 )
 
 from .pagination import NotificationViewSetPagination
+from .recommendations import user_features
+from .search import search_users
+from .ratings import submit_ratings, lock_rater, RatingError
+from .leaderboards import leaderboards
+from .presence import presence
+from .teammates import get_teammate_ids
+from .notifications import notify, unread_counts_changed
+from .learning_model.executor import prediction_executor, PredictionUnavailable
 
 
 class TeamViewSet(viewsets.ModelViewSet):
@@ -78,10 +88,8 @@ class TeamViewSet(viewsets.ModelViewSet):
 
         users_list = []
         search_str = serializer.validated_data["search_str"]
-        if search_str:  
-            searching_result = User.objects.filter(username__icontains=search_str)
-            for user in searching_result:
-                users_list.append((user.username, user.id))
+        if search_str:
+            users_list = [(user["username"], user["id"]) for user in search_users(search_str)]
 
         invited_user_id = serializer.validated_data["invited_user_id"]
         if invited_user_id == 0:
@@ -100,6 +108,35 @@ class TeamViewSet(viewsets.ModelViewSet):
 
         return Response({"message": "Invitation is sent!", "searching_result": users_list}, status=status.HTTP_200_OK)
     
+    @action(detail=True, methods=["get"])
+    def recommend(self, request, pk=None):
+        team = self.get_object()
+        check_result = self._leadership_checker(team)
+        if check_result:
+            return check_result
+
+        serializer = RecommendTeammatesSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+
+        member_ids = list(team.members.values_list("id", flat=True))
+        invited_ids = team.invitations.filter(status="PENDING").values_list("invited_user_id", flat=True)
+        ranking = user_features.recommend(member_ids, k=serializer.validated_data["k"], exclude_ids=invited_ids)
+
+        users = User.objects.in_bulk([user_id for user_id, _ in ranking])
+        recommendations = [
+            {"id": user_id, "username": users[user_id].username, "type": users[user_id].type,
+             "score": users[user_id].score, "match": round(match, 3)}
+            for user_id, match in ranking if user_id in users
+        ]
+        return Response({"recommendations": recommendations}, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=["get"])
+    def leaderboard(self, request, pk=None):
+        team = self.get_object()
+        members = team.members.order_by(F("score").desc(nulls_last=True), "username").values("id", "username", "type", "score")
+        return Response({"results": [{"rank": rank, **member} for rank, member in enumerate(members, start=1)]},
+                        status=status.HTTP_200_OK)
+
     @action(detail=True, methods=["get", "post"])
     def remove_member(self, request, pk=None):
 
@@ -146,10 +183,7 @@ class InvitationViewSet(viewsets.ModelViewSet):
             user = request.user
             invitation = serializer.save(invited_by=user)
 
-            Notification.objects.create(
-                user=invitation.invited_user,
-                message=f"You have a new invitation from {user}!"
-            )
+            notify(invitation.invited_user, f"You have a new invitation from {user}!")
 
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -200,17 +234,43 @@ class UserViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return User.objects.exclude(id=self.request.user.id)
 
+    @action(detail=False, methods=["get"])
+    def search(self, request):
+        serializer = UserSearchSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        users = search_users(serializer.validated_data["q"], serializer.validated_data["limit"])
+        return Response({"results": users}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"])
+    def teammates(self, request):
+        teammates = User.objects.teammates_of(request.user).order_by("username").values("id", "username", "type", "score")
+        return Response({"teammates": list(teammates)}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"])
+    def online_teammates(self, request):
+        online_ids = presence.online(get_teammate_ids(request.user.id))
+        teammates = User.objects.filter(id__in=online_ids).order_by("username").values("id", "username", "type")
+        return Response({"online": list(teammates)}, status=status.HTTP_200_OK)
+
 
     def perform_update(self, serializer):
-        rated_user = self.get_object()
-        rater_user_teams = Team.objects.filter(members=self.request.user)
-        rated_user_teams = Team.objects.filter(members=rated_user)
-        if not rated_user_teams.intersection(rater_user_teams).exists():
+        rated_user = serializer.instance
+        if not User.objects.are_teammates(self.request.user, rated_user):
             raise ValidationError({"message": "You can only rate your teammates!"})
 
-        rate = serializer.validated_data["score"]
-        rated_user.calculate_new_score(rate)
-        return super().perform_update(serializer)
+        # The rating is recorded like the ones of the ratings page (once per rater) and goes through
+        # the atomic aggregate update, the other fields (if any) through save().
+        rate = serializer.validated_data.pop("score", None)
+        if rate is not None:
+            try:
+                with transaction.atomic():
+                    lock_rater(self.request.user)
+                    UserRating.objects.create(rater=self.request.user, rated=rated_user, rating=int(rate))
+                    rated_user.calculate_new_score(rate)
+            except IntegrityError:
+                raise ValidationError({"message": "You have rated this user before!"})
+        if serializer.validated_data:
+            return super().perform_update(serializer)
 
 
 
@@ -229,6 +289,98 @@ class ToggleAvailabilityAPIView(APIView):
 
 
 
+class PredictUserTypesAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        serializer = PredictUserTypesSerializer()
+        return Response(serializer.data)
+
+    def post(self, request):
+        serializer = PredictUserTypesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        skills = serializer.validated_data["skills"]
+        try:
+            types = [user_type.upper() for user_type in prediction_executor.predict_many(skills)]
+        except PredictionUnavailable as error:
+            return Response({"message": str(error)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response({"types": types}, status=status.HTTP_200_OK)
+
+
+
+class BulkRatingAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        serializer = BulkRatingSerializer()
+        return Response(serializer.data)
+
+    def post(self, request):
+        serializer = BulkRatingSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user_ratings = {item["user_id"]: item["rating"] for item in serializer.validated_data.get("users", [])}
+        team_ratings = {item["team_id"]: item["rating"] for item in serializer.validated_data.get("teams", [])}
+        try:
+            result = submit_ratings(request.user, user_ratings, team_ratings)
+        except RatingError as error:
+            detail = error.args[0]
+            return Response(detail if isinstance(detail, dict) else {"message": detail},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(result, status=status.HTTP_200_OK)
+
+
+
+class UserLeaderboardAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        serializer = LeaderboardSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        limit, offset = serializer.validated_data["limit"], serializer.validated_data["offset"]
+
+        leaderboards.ensure_built()
+        board = leaderboards.users(serializer.validated_data.get("type"))
+        ranking = board.top(limit, offset)
+        users = User.objects.only("id", "username", "type").in_bulk([user_id for user_id, _ in ranking])
+        results = [
+            {"rank": offset + position, "id": user_id, "username": users[user_id].username,
+             "type": users[user_id].type, "score": score}
+            for position, (user_id, score) in enumerate(ranking, start=1) if user_id in users
+        ]
+
+        my_rank = board.rank(request.user.id)
+        me = {"rank": my_rank[0] + 1, "score": my_rank[1]} if my_rank else None
+        return Response({"results": results, "me": me, "total": len(board)}, status=status.HTTP_200_OK)
+
+
+
+class TeamLeaderboardAPIView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        serializer = LeaderboardSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        limit, offset = serializer.validated_data["limit"], serializer.validated_data["offset"]
+
+        leaderboards.ensure_built()
+        board = leaderboards.teams()
+        ranking = board.top(limit, offset)
+        teams = Team.objects.only("id", "name").in_bulk([team_id for team_id, _ in ranking])
+        results = [
+            {"rank": offset + position, "id": team_id, "name": teams[team_id].name, "score": score}
+            for position, (team_id, score) in enumerate(ranking, start=1) if team_id in teams
+        ]
+
+        mine = []
+        for team_id, name in Team.objects.filter(members=request.user).values_list("id", "name"):
+            team_rank = board.rank(team_id)
+            if team_rank:
+                mine.append({"rank": team_rank[0] + 1, "id": team_id, "name": name, "score": team_rank[1]})
+        return Response({"results": results, "mine": sorted(mine, key=lambda team: team["rank"]), "total": len(board)},
+                        status=status.HTTP_200_OK)
+
+
+
 class TaskViewSet(viewsets.ModelViewSet):
     serializer_class = TaskSerializer
     permission_classes = [IsAuthenticated]
@@ -250,7 +402,7 @@ class TaskViewSet(viewsets.ModelViewSet):
             return  Response({"message": "Only team leaders can do this!"},
                              status=status.HTTP_403_FORBIDDEN)
         task.change_status()
-        task.save()
+        task.save(update_fields=["status"])
         return Response({"message": "Task marked as completed!"}, status=status.HTTP_200_OK)
     
 
@@ -289,10 +441,33 @@ class NotificationViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Notification.objects.filter(user=self.request.user)
     
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        if not instance.is_read:
+            unread_counts_changed([instance.user_id])
+
+    @action(detail=False, methods=["get"])
+    def unread_count(self, request):
+        return Response({"unread_count": request.user.unread_notifications}, status=status.HTTP_200_OK)
+
     @action(detail=False, methods=["get", "post"])
     def mark_all_as_read(self, request):
-        notifications = Notification.objects.filter(user=request.user)
-        for notification in notifications:
-            notification.mark_as_read()
-        return Response({"message": "All notifications are marked as read!"}, status=status.HTTP_200_OK)
+        updated = self.get_queryset().mark_as_read()
+        return Response({"message": "All notifications are marked as read!", "updated": updated}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["post"])
+    def mark_as_read(self, request):
+        serializer = MarkNotificationsAsReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated = self.get_queryset().filter(id__in=serializer.validated_data["ids"]).mark_as_read()
+        return Response({"message": "Notifications are marked as read!", "updated": updated}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=["post"])
+    def delete_read(self, request):
+        serializer = DeleteReadNotificationsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        notifications = self.get_queryset().read_older_than(serializer.validated_data["older_than_days"])
+        # Notifications have no dependent rows or delete signals, so Django deletes them with a single DELETE.
+        deleted, _ = notifications.delete()
+        return Response({"message": "Read notifications are deleted!", "deleted": deleted}, status=status.HTTP_200_OK)
 
@@ -0,0 +1,217 @@
+import threading
+from bisect import bisect_left, insort
+
+from django.apps import apps
+
+from .utils import get_redis_client
+
+
+
+class MemoryLeaderboard:
+    """
+    This class is a per-process sorted ranking used when Redis isn't available.
+    Entries are kept as (-score, id) in a sorted list, so ranks are a bisect away.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._scores = {}
+        self._lock = threading.Lock()
+
+
+    def _remove(self, member_id):
+        score = self._scores.pop(member_id, None)
+        if score is not None:
+            del self._entries[bisect_left(self._entries, (-score, member_id))]
+
+
+    def update(self, member_id, score):
+        with self._lock:
+            self._remove(member_id)
+            self._scores[member_id] = score
+            insort(self._entries, (-score, member_id))
+
+
+    def remove(self, member_id):
+        with self._lock:
+            self._remove(member_id)
+
+
+    def replace(self, items):
+        with self._lock:
+            self._scores = dict(items)
+            self._entries = sorted((-score, member_id) for member_id, score in self._scores.items())
+
+
+    def top(self, limit, offset=0):
+        with self._lock:
+            return [(member_id, -score) for score, member_id in self._entries[offset:offset + limit]]
+
+
+    def rank(self, member_id):
+        """This method returns the 0-based rank and score of a member, or None if the member isn't ranked."""
+        with self._lock:
+            score = self._scores.get(member_id)
+            if score is None:
+                return None
+            return bisect_left(self._entries, (-score, member_id)), score
+
+
+    def __len__(self):
+        return len(self._entries)
+
+
+
+class RedisLeaderboard:
+    """This class is a ranking kept in a Redis sorted set, shared by every worker."""
+
+    REPLACE_CHUNK = 5000
+
+    def __init__(self, client, key):
+        self.client = client
+        self.key = key
+
+
+    def update(self, member_id, score):
+        self.client.zadd(self.key, {member_id: score})
+
+
+    def remove(self, member_id):
+        self.client.zrem(self.key, member_id)
+
+
+    def replace(self, items):
+        """The new ranking is written to a temporary key and renamed over the live one in one step."""
+        tmp_key = f"{self.key}:rebuild"
+        self.client.delete(tmp_key)
+        chunk = {}
+        for member_id, score in items:
+            chunk[member_id] = score
+            if len(chunk) >= self.REPLACE_CHUNK:
+                self.client.zadd(tmp_key, chunk)
+                chunk = {}
+        if chunk:
+            self.client.zadd(tmp_key, chunk)
+
+        if self.client.exists(tmp_key):
+            self.client.rename(tmp_key, self.key)
+        else:
+            self.client.delete(self.key)
+
+
+    def top(self, limit, offset=0):
+        if limit <= 0:
+            return []
+        entries = self.client.zrevrange(self.key, offset, offset + limit - 1, withscores=True)
+        return [(int(member_id), score) for member_id, score in entries]
+
+
+    def rank(self, member_id):
+        with self.client.pipeline() as pipeline:
+            rank, score = pipeline.zrevrank(self.key, member_id).zscore(self.key, member_id).execute()
+        return None if rank is None else (rank, score)
+
+
+    def __len__(self):
+        return self.client.zcard(self.key)
+
+
+
+class Leaderboards:
+    """
+    This class keeps the materialized user and team rankings: every rated user, every rated user
+    of each character type, and every rated team. Rankings are updated incrementally when a score changes
+    and rebuilt from the database with "python manage.py rebuild_leaderboards" (or on first use),
+    so top-N and rank lookups never sort the user or team table.
+    """
+
+    def __init__(self, key_prefix="teamups:leaderboard"):
+        self.key_prefix = key_prefix
+        self._boards = {}
+        self._built = False
+        self._lock = threading.Lock()
+
+
+    def board(self, name):
+        board = self._boards.get(name)
+        if board is None:
+            client = get_redis_client()
+            board = RedisLeaderboard(client, f"{self.key_prefix}:{name}") if client else MemoryLeaderboard()
+            self._boards[name] = board
+        return board
+
+
+    def users(self, user_type=None):
+        return self.board(f"users:{user_type.upper()}" if user_type else "users")
+
+
+    def teams(self):
+        return self.board("teams")
+
+
+    def _user_types(self):
+        return [user_type for user_type, _ in apps.get_model("main", "User").CHARACTER_TYPES]
+
+
+    def record_user(self, user):
+        if user.is_superuser or not user.score_count or user.score is None:
+            self.remove_user(user.id)
+            return
+        user_type = (user.type or "").upper()
+        self.users().update(user.id, float(user.score))
+        for other_type in self._user_types():
+            if other_type == user_type:
+                self.users(other_type).update(user.id, float(user.score))
+            else:
+                self.users(other_type).remove(user.id)
+
+
+    def remove_user(self, user_id):
+        self.users().remove(user_id)
+        for user_type in self._user_types():
+            self.users(user_type).remove(user_id)
+
+
+    def record_team(self, team):
+        if team.score_count and team.teamwork_score is not None:
+            self.teams().update(team.id, float(team.teamwork_score))
+        else:
+            self.teams().remove(team.id)
+
+
+    def remove_team(self, team_id):
+        self.teams().remove(team_id)
+
+
+    def rebuild(self):
+        """This method rebuilds every ranking from the database, streaming the rated users and teams."""
+        User = apps.get_model("main", "User")
+        Team = apps.get_model("main", "Team")
+
+        users = (User.objects.filter(is_superuser=False, score_count__gt=0, score__isnull=False)
+                 .values_list("id", "score").iterator(chunk_size=2000))
+        self.users().replace((user_id, float(score)) for user_id, score in users)
+        for user_type in self._user_types():
+            users = (User.objects.filter(is_superuser=False, score_count__gt=0, score__isnull=False, type__iexact=user_type)
+                     .values_list("id", "score").iterator(chunk_size=2000))
+            self.users(user_type).replace((user_id, float(score)) for user_id, score in users)
+
+        teams = (Team.objects.filter(score_count__gt=0, teamwork_score__isnull=False)
+                 .values_list("id", "teamwork_score").iterator(chunk_size=2000))
+        self.teams().replace((team_id, float(score)) for team_id, score in teams)
+        self._built = True
+
+
+    def ensure_built(self):
+        """In-process rankings start empty, they are built from the database the first time they are read."""
+        if self._built:
+            return
+        with self._lock:
+            if not self._built:
+                if get_redis_client() is None or not len(self.users()):
+                    self.rebuild()
+                self._built = True
+
+
+
+leaderboards = Leaderboards()
@@ -0,0 +1,60 @@
+import json
+import os
+import secrets
+import tempfile
+from datetime import datetime, timezone
+
+from .matchmaker import BASE_DIR, MANIFEST_PATH
+
+
+
+def new_version():
+    """
+    Versions sort by training time and are unique, even for two runs in the same second (or on two hosts),
+    so an artifact is never overwritten and every activation is a new version for the running workers.
+    """
+    return f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}-{secrets.token_hex(3)}"
+
+
+
+def _atomic_replace(path, write):
+    """
+    This function writes a file through a temporary file in the same directory and renames it over path,
+    so readers see either the old file or the complete new one, never a partial write.
+    """
+    directory = os.path.dirname(path)
+    descriptor, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(descriptor)
+    try:
+        write(tmp_path)
+        with open(tmp_path, "rb") as tmp_file:
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return path
+
+
+
+def write_artifact(artifact, version, directory=BASE_DIR):
+    """This function dumps a (model, vectorizer, encoder) tuple to model-<version>.pkl."""
+    import joblib
+
+    path = os.path.join(directory, f"model-{version}.pkl")
+    return _atomic_replace(path, lambda tmp_path: joblib.dump(artifact, tmp_path))
+
+
+
+def activate(path, version, manifest_path=MANIFEST_PATH):
+    """
+    This function points the manifest at a versioned artifact.
+    Running workers notice the new manifest and reload the model on their next prediction.
+    """
+    manifest = {"version": version, "path": os.path.relpath(path, os.path.dirname(manifest_path))}
+
+    def write(tmp_path):
+        with open(tmp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+
+    return _atomic_replace(manifest_path, write)
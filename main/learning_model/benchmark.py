@@ -0,0 +1,144 @@
+"""
+Micro benchmarks for the matchmaker.
+
+Run from the project root:
+    python -m main.learning_model.benchmark batch [batch_size]
+    python -m main.learning_model.benchmark indexes [users]
+"""
+import pickle
+import random
+import sys
+import time
+
+from .matchmaker import registry, predict_user_type, predict_user_types
+
+
+
+def sample_skills(count, seed=0):
+    """This function builds random skill strings out of the vectorizer's vocabulary."""
+    vocabulary = sorted(registry.get().vectorizer.vocabulary_)
+    rng = random.Random(seed)
+    return [", ".join(rng.sample(vocabulary, k=min(3, len(vocabulary)))) for _ in range(count)]
+
+
+
+def time_it(function, *args, repeat=5):
+    """This function returns the best wall time of several runs, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+
+def per_call_loop(skills):
+    """The way MySignUpForm.clean_type predicts: one call per user."""
+    return [predict_user_type(skill) for skill in skills]
+
+
+
+def compare_batch_prediction(batch_size=500):
+    registry.warm_up()
+    skills = sample_skills(batch_size)
+
+    assert per_call_loop(skills) == predict_user_types(skills)
+
+    # Measure the model itself, not the prediction cache.
+    cache = registry.get().cache
+    cache.maxsize = 0
+    cache.clear()
+    loop_time = time_it(per_call_loop, skills)
+    batch_time = time_it(predict_user_types, skills)
+    return {
+        "batch_size": batch_size,
+        "per_call_loop_s": loop_time,
+        "batch_s": batch_time,
+        "speedup": loop_time / batch_time,
+    }
+
+
+
+def synthetic_corpus(users, seed=0):
+    """
+    This function generates users whose skills are drawn mostly from a per-type word pool,
+    to see how the indexes behave with a user table much larger than the real one.
+    """
+    rng = random.Random(seed)
+    types = ["leader", "supporter", "thinker", "doer", "connector"]
+    shared_words = [f"skill{i}" for i in range(500)]
+    pools = {user_type: [f"{user_type}{i}" for i in range(40)] for user_type in types}
+
+    skills, characters = [], []
+    for _ in range(users):
+        user_type = rng.choice(types)
+        words = rng.sample(pools[user_type], k=3) + rng.sample(shared_words, k=2)
+        skills.append(" ".join(words))
+        characters.append(user_type)
+    return skills, characters
+
+
+
+def evaluate_index(trainer, skills, characters, folds=5, latency_samples=200, seed=0):
+    """
+    This function cross-validates one trainer from train.TRAINERS and returns its accuracy,
+    the mean latency of a single-user prediction (like a signup) and the pickled artifact size.
+    """
+    indexes = list(range(len(skills)))
+    random.Random(seed).shuffle(indexes)
+    folds = max(2, min(folds, len(indexes)))
+
+    correct = total = 0
+    latency = 0.0
+    timed = 0
+    for fold in range(folds):
+        test = indexes[fold::folds]
+        test_set = set(test)
+        train = [i for i in indexes if i not in test_set]
+        model, vectorizer, encoder = trainer([skills[i] for i in train], [characters[i] for i in train])
+
+        predictions = encoder.inverse_transform(model.predict(vectorizer.transform([skills[i] for i in test])))
+        correct += sum(prediction == characters[i] for prediction, i in zip(predictions, test))
+        total += len(test)
+
+        for i in test[:latency_samples]:
+            start = time.perf_counter()
+            encoder.inverse_transform(model.predict(vectorizer.transform([skills[i]])))
+            latency += time.perf_counter() - start
+            timed += 1
+
+    artifact = trainer(skills, characters)
+    return {
+        "accuracy": correct / total,
+        "latency_ms": latency / timed * 1000,
+        "artifact_kb": len(pickle.dumps(artifact)) / 1024,
+    }
+
+
+
+def compare_indexes(skills, characters, folds=5):
+    from .train import TRAINERS
+
+    return {name: evaluate_index(trainer, skills, characters, folds) for name, trainer in TRAINERS.items()}
+
+
+
+def print_report(report, stream=None):
+    """This function writes the report as a table to stream (stdout by default)."""
+    stream = stream or sys.stdout
+    stream.write(f"{'index':<10}{'accuracy':>10}{'latency_ms':>12}{'artifact_kb':>13}\n")
+    for name, row in report.items():
+        stream.write(f"{name:<10}{row['accuracy']:>10.3f}{row['latency_ms']:>12.3f}{row['artifact_kb']:>13.1f}\n")
+
+
+
+if __name__ == "__main__":
+    mode = sys.argv[1] if len(sys.argv) > 1 else "batch"
+    size = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    if mode == "indexes":
+        print_report(compare_indexes(*synthetic_corpus(size)))
+    else:
+        for key, value in compare_batch_prediction(size).items():
+            print(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
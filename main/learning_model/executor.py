@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+
+from .matchmaker import predict_user_types
+
+
+
+class PredictionUnavailable(Exception):
+    """Raised when the prediction pool is saturated or a prediction didn't finish in time."""
+
+
+
+class PredictionExecutor:
+    """
+    This class runs matchmaker predictions on a bounded pool instead of the calling thread,
+    so a request thread or the ASGI event loop is never busy with sklearn inference.
+    When more than max_queue predictions are pending, new ones are rejected right away
+    and callers fall back to asking the user for their type.
+    """
+
+    POOL_CLASSES = {"thread": ThreadPoolExecutor, "process": ProcessPoolExecutor}
+
+    def __init__(self, kind="thread", max_workers=2, max_queue=32, timeout=2.0):
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pool = None
+        self._lock = threading.Lock()
+
+        self.pending = 0
+        self.max_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_latency = 0.0
+
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = self.POOL_CLASSES[self.kind](max_workers=self.max_workers)
+        return self._pool
+
+
+    def submit(self, skills: list[str]):
+        pool = self._get_pool()
+        with self._lock:
+            if self.pending >= self.max_queue:
+                self.rejected += 1
+                raise PredictionUnavailable("The prediction queue is full!")
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+
+        submitted_at = time.perf_counter()
+
+        def on_done(future):
+            with self._lock:
+                self.pending -= 1
+                if not future.cancelled():
+                    self.completed += 1
+                    self.total_latency += time.perf_counter() - submitted_at
+
+        try:
+            future = pool.submit(predict_user_types, skills)
+        except Exception as error:
+            # A pool that was shut down or broke (a killed worker process) takes no more work.
+            with self._lock:
+                self.pending -= 1
+            raise PredictionUnavailable("The prediction pool is unavailable!") from error
+        future.add_done_callback(on_done)
+        return future
+
+
+    def predict_many(self, skills: list[str], timeout=None) -> list[str]:
+        future = self.submit(skills)
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except TimeoutError:
+            future.cancel()
+            self._count_timeout()
+            raise PredictionUnavailable("The prediction took too long!")
+
+
+    def predict(self, skill: str, timeout=None) -> str:
+        return self.predict_many([skill], timeout)[0]
+
+
+    async def apredict_many(self, skills: list[str], timeout=None) -> list[str]:
+        future = self.submit(skills)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            self._count_timeout()
+            raise PredictionUnavailable("The prediction took too long!")
+
+
+    async def apredict(self, skill: str, timeout=None) -> str:
+        return (await self.apredict_many([skill], timeout))[0]
+
+
+    def _count_timeout(self):
+        with self._lock:
+            self.timed_out += 1
+
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "mean_latency": self.total_latency / self.completed if self.completed else None,
+            }
+
+
+
+prediction_executor = PredictionExecutor()
@@ -0,0 +1,51 @@
+import numpy as np
+from scipy import sparse
+
+
+
+class CentroidClassifier:
+    """
+    A nearest-centroid classifier: every type is summarized by the mean of its users' skill vectors,
+    and a query is assigned to the most similar centroid (cosine similarity on L2-normalized rows).
+    The artifact holds one row per type instead of one row per user, so both its size
+    and the query time are independent of how many users it was trained on.
+    partial_fit() accumulates the per-type sums, so it can be trained chunk by chunk.
+    """
+
+    def __init__(self, n_classes):
+        self.n_classes = n_classes
+        self.sums_ = None
+        self.counts_ = np.zeros(n_classes, dtype=np.int64)
+        self.centroids_ = None
+
+
+    def partial_fit(self, X, y):
+        X = sparse.csr_matrix(X)
+        y = np.asarray(y)
+        if self.sums_ is None:
+            self.sums_ = np.zeros((self.n_classes, X.shape[1]))
+
+        # A (n_classes x n_rows) indicator matrix turns the per-type sums into a single sparse product.
+        indicator = sparse.csr_matrix((np.ones(len(y)), (y, np.arange(len(y)))), shape=(self.n_classes, len(y)))
+        self.sums_ += (indicator @ X).toarray()
+        self.counts_ += np.bincount(y, minlength=self.n_classes)
+        self._update_centroids()
+        return self
+
+
+    def fit(self, X, y):
+        self.sums_ = None
+        self.counts_ = np.zeros(self.n_classes, dtype=np.int64)
+        return self.partial_fit(X, y)
+
+
+    def predict(self, X):
+        scores = sparse.csr_matrix(X) @ self.centroids_.T
+        scores[:, self.counts_ == 0] = -np.inf
+        return np.asarray(scores).argmax(axis=1)
+
+
+    def _update_centroids(self):
+        norms = np.linalg.norm(self.sums_, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self.centroids_ = (self.sums_ / norms).astype(np.float32)
@@ -1,14 +1,218 @@
-import joblib
+import json
+import logging
 import os
+import re
+import threading
+import time
+from collections import OrderedDict
 
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_PATH = os.path.join(BASE_DIR, "model.pkl")
-model, vectorizer, encoder = joblib.load(MODEL_PATH)
+MANIFEST_PATH = os.path.join(BASE_DIR, "manifest.json")
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+
+def normalize_skills(skill: str) -> str:
+    """
+    This function returns the cache key of a skill string: lowercased, token-sorted and deduplicated,
+    so "Python, Django" and "django python python" share the same key.
+    The vectorizer is a bag of words, so token order never changes the prediction.
+    """
+    return " ".join(sorted(set(TOKEN_PATTERN.findall(skill.lower()))))
+
+
+
+class PredictionCache:
+    """A bounded, thread-safe LRU cache of predicted types keyed on normalized skills."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+            return value
+
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+
+
+class LoadedModel:
+    """
+    This class keeps a loaded (model, vectorizer, encoder) artifact together with its prediction cache,
+    so loading a new artifact always starts with an empty cache.
+    """
+
+    def __init__(self, artifact, cache_size, version=None):
+        self.model, self.vectorizer, self.encoder = artifact
+        self.version = version
+        self.cache = PredictionCache(cache_size)
+
+
+    def predict(self, skills):
+        keys = [normalize_skills(skill) for skill in skills]
+        results = [self.cache.get(key) for key in keys]
+
+        missing = sorted({key for key, result in zip(keys, results) if result is None})
+        if missing:
+            predictions = self.encoder.inverse_transform(self.model.predict(self.vectorizer.transform(missing)))
+            predicted = dict(zip(missing, predictions))
+            for key, user_type in predicted.items():
+                self.cache.put(key, user_type)
+            results = [predicted[key] if result is None else result for key, result in zip(keys, results)]
+
+        return results
+
+
+
+class ModelRegistry:
+    """
+    This class holds the matchmaker's loaded model.
+    The artifact is loaded on first use instead of at import time, so processes that
+    never predict a type (management commands, most workers) don't pay for sklearn.
+    mmap_mode="r" lets forked workers share the model arrays copy-on-write.
+
+    When manifest.json exists it names the active versioned artifact, otherwise model.pkl is loaded.
+    At most once every reload_interval seconds get() stats the manifest, and if another version was
+    activated it loads it and swaps the whole LoadedModel in one assignment, so running workers pick up
+    a retrained model without a restart and a request never sees a half-loaded one.
+    """
+
+    def __init__(self, path=MODEL_PATH, manifest_path=MANIFEST_PATH, mmap_mode="r", cache_size=1024, reload_interval=5.0):
+        self.path = path
+        self.manifest_path = manifest_path
+        self.mmap_mode = mmap_mode
+        self.cache_size = cache_size
+        self.reload_interval = reload_interval
+        self.load_time = None
+        self._loaded = None
+        self._manifest_stamp = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+
+    @property
+    def is_loaded(self):
+        return self._loaded is not None
+
+
+    def get(self) -> LoadedModel:
+        loaded = self._loaded
+        if loaded is None:
+            with self._lock:
+                return self._refresh()
+
+        if self.reload_interval is not None and time.monotonic() >= self._next_check:
+            # Requests arriving while another thread checks or loads keep using the current model.
+            if self._lock.acquire(blocking=False):
+                try:
+                    loaded = self._refresh()
+                finally:
+                    self._lock.release()
+        return loaded
+
+
+    def warm_up(self):
+        """This method loads the artifact ahead of the first request (e.g. before workers fork)."""
+        self.get()
+        return self.load_time
+
+
+    def _manifest_stamp_now(self):
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+
+    def _resolve(self):
+        """This method returns the (path, version) of the active artifact."""
+        if not os.path.exists(self.manifest_path):
+            return self.path, None
+        with open(self.manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        return os.path.join(os.path.dirname(self.manifest_path), manifest["path"]), manifest["version"]
+
+
+    def _refresh(self):
+        """This method must be called with the lock held."""
+        if self.reload_interval is not None:
+            self._next_check = time.monotonic() + self.reload_interval
+
+        stamp = self._manifest_stamp_now()
+        if self._loaded is not None and stamp == self._manifest_stamp:
+            return self._loaded
+
+        try:
+            path, version = self._resolve()
+            if self._loaded is None or version != self._loaded.version:
+                self._loaded = self._load(path, version)
+        except Exception:
+            if self._loaded is None:
+                raise
+            logger.exception("Reloading the matchmaker model failed, keeping version %s", self._loaded.version)
+
+        self._manifest_stamp = stamp
+        return self._loaded
+
+
+    def _load(self, path, version):
+        import joblib
+
+        start = time.perf_counter()
+        artifact = joblib.load(path, mmap_mode=self.mmap_mode)
+        self.load_time = time.perf_counter() - start
+        logger.info("Matchmaker model %s loaded from %s in %.3fs", version, path, self.load_time)
+        return LoadedModel(artifact, self.cache_size, version)
+
+
+
+registry = ModelRegistry()
 
 
 def predict_user_type(skill: str) -> str:
-    test_vec = vectorizer.transform([skill.lower()])
-    prediction = model.predict(test_vec)
-    return encoder.inverse_transform(prediction)[0]
+    return registry.get().predict([skill])[0]
+
 
+def predict_user_types(skills: list[str]) -> list[str]:
+    """
+    This function predicts the types of many users at once,
+    using one vectorizer.transform() and one model.predict() call for the skills missing from the cache.
+    The types are returned in the same order as the given skills.
+    """
+    if not skills:
+        return []
+    return registry.get().predict(skills)
@@ -1,30 +1,101 @@
-import sqlite3
-from sklearn.feature_extraction.text import CountVectorizer
+"""
+Trainers of the matchmaker's (model, vectorizer, encoder) tuple.
+Run "python manage.py train_matchmaker" to train from the database.
+
+"knn" is the original 1-nearest-neighbour model over every user's skill vector.
+"centroid" keeps one centroid per type, so the artifact size and the query time
+don't grow with the user table.
+"""
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
 from sklearn.preprocessing import LabelEncoder
 from sklearn.neighbors import KNeighborsClassifier
-import joblib
+
+from .index import CentroidClassifier
+
+
+HASHING_FEATURES = 2 ** 12
+
+
+
+def train_knn(skills, characters):
+    vectorizer = CountVectorizer()
+    X = vectorizer.fit_transform(skills)
+
+    encoder = LabelEncoder()
+    y = encoder.fit_transform(characters)
+
+    model = KNeighborsClassifier(n_neighbors=1)
+    model.fit(X, y)
+    return model, vectorizer, encoder
+
+
+
+def make_hashing_vectorizer(n_features=HASHING_FEATURES, norm="l2"):
+    """The hashing vectorizer is stateless, so it needs no fitting and no vocabulary in the artifact."""
+    return HashingVectorizer(n_features=n_features, alternate_sign=False, norm=norm)
+
+
+
+def train_centroid(skills, characters, n_features=HASHING_FEATURES):
+    vectorizer = make_hashing_vectorizer(n_features)
+    X = vectorizer.transform(skills)
+
+    encoder = LabelEncoder()
+    y = encoder.fit_transform(characters)
+
+    model = CentroidClassifier(n_classes=len(encoder.classes_))
+    model.fit(X, y)
+    return model, vectorizer, encoder
+
+
+
+TRAINERS = {
+    "knn": train_knn,
+    "centroid": train_centroid,
+}
 
 
-connector = sqlite3.connect(r"C:\\Users\\Home\Documents\\Projects\\TeamUps\\teamups\\db.sqlite3")
-cursor = connector.cursor()
 
+def stream_centroid(chunks, classes, n_features=HASHING_FEATURES):
+    """
+    This function trains the centroid index from an iterable of (skills, characters) chunks.
+    Only one chunk and the per-type sums are held in memory at a time.
+    """
+    vectorizer = make_hashing_vectorizer(n_features)
+    encoder = LabelEncoder().fit(classes)
+    model = CentroidClassifier(n_classes=len(encoder.classes_))
 
-cursor.execute("SELECT id, skills, score, score_count, type FROM main_user")
-rows = cursor.fetchall()
+    for skills, characters in chunks:
+        model.partial_fit(vectorizer.transform(skills), encoder.transform(characters))
+    return model, vectorizer, encoder
 
 
-skills = [row[1].lower() for row in rows]
-characters = [row[4].lower() for row in rows]
 
-vectorizer = CountVectorizer()
-X = vectorizer.fit_transform(skills)
+def stream_knn(chunks, classes, n_features=HASHING_FEATURES):
+    """
+    This function trains the 1-NN model from an iterable of (skills, characters) chunks.
+    Skills are hashed chunk by chunk instead of building a vocabulary over the whole corpus,
+    but the model itself still has to keep every user's (sparse) row.
+    It returns None when the chunks are empty, there is nothing to fit then.
+    """
+    vectorizer = make_hashing_vectorizer(n_features, norm=None)
+    encoder = LabelEncoder().fit(classes)
 
-encoder = LabelEncoder()
-y = encoder.fit_transform(characters)
+    rows, labels = [], []
+    for skills, characters in chunks:
+        rows.append(vectorizer.transform(skills))
+        labels.extend(encoder.transform(characters))
+    if not rows:
+        return None
 
-model = KNeighborsClassifier(n_neighbors=1)
-model.fit(X, y)
+    model = KNeighborsClassifier(n_neighbors=1)
+    model.fit(sparse.vstack(rows).tocsr(), labels)
+    return model, vectorizer, encoder
 
 
-joblib.dump((model, vectorizer, encoder), "model.pkl")
 
+STREAMING_TRAINERS = {
+    "knn": stream_knn,
+    "centroid": stream_centroid,
+}
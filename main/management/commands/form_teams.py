@@ -0,0 +1,44 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from main.team_formation import form_teams, TeamFormationError
+
+
+User = get_user_model()
+
+
+
+class Command(BaseCommand):
+    help = "Splits a pool of available users into balanced teams and sends their leadership invitations."
+
+    def add_arguments(self, parser):
+        parser.add_argument("prefix", help='Teams are named "<prefix>-1", "<prefix>-2", ...')
+        parser.add_argument("--invited-by", required=True, help="Username that sends the leadership invitations.")
+        parser.add_argument("--size", type=int, default=5)
+        parser.add_argument("--filter", action="append", default=[], metavar="LOOKUP=VALUE",
+                            help='Extra user filter, e.g. --filter type=DOER --filter skills__icontains=python')
+        parser.add_argument("--unteamed", action="store_true", help="Only users who are not in any team yet.")
+        parser.add_argument("--rounds", type=int, default=5000, help="Local improvement swaps to try.")
+
+
+    def handle(self, *args, **options):
+        invited_by = User.objects.filter(username=options["invited_by"]).first()
+        if not invited_by:
+            raise CommandError("The inviting user is not found!")
+
+        users = User.objects.available().filter(is_superuser=False)
+        for lookup in options["filter"]:
+            field, _, value = lookup.partition("=")
+            users = users.filter(**{field: value})
+        if options["unteamed"]:
+            users = users.filter(teams__isnull=True)
+
+        try:
+            teams, report = form_teams(users, options["size"], options["prefix"], invited_by,
+                                       improvement_rounds=options["rounds"])
+        except TeamFormationError as error:
+            raise CommandError(str(error))
+
+        for key, value in report.items():
+            self.stdout.write(f"{key}: {value:.4f}" if isinstance(value, float) else f"{key}: {value}")
+        self.stdout.write(self.style.SUCCESS(f"{len(teams)} teams created!"))
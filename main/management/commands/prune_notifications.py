@@ -0,0 +1,81 @@
+import gzip
+import json
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min, Max
+
+from main.models import Notification
+
+
+
+class Command(BaseCommand):
+    help = "Deletes (or archives and deletes) read notifications older than the retention period."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=settings.NOTIFICATIONS["RETENTION_DAYS"],
+                            help="Retention period, read notifications older than this are pruned.")
+        parser.add_argument("--batch-size", type=int, default=settings.NOTIFICATIONS["PRUNE_BATCH_SIZE"],
+                            help="Number of primary keys covered by each DELETE.")
+        parser.add_argument("--archive", metavar="PATH",
+                            help="Append the pruned notifications to this JSON lines file (gzipped if it ends with .gz).")
+        parser.add_argument("--sleep", type=float, default=0.0, help="Seconds to pause between batches.")
+        parser.add_argument("--dry-run", action="store_true", help="Only report what would be pruned.")
+
+
+    def batches(self, notifications, batch_size):
+        """
+        This method yields the notifications to prune in primary key ranges of batch_size,
+        so every DELETE is short and locks few rows, whatever the size of the table.
+        """
+        bounds = notifications.aggregate(first=Min("id"), last=Max("id"))
+        start = bounds["first"]
+        while start is not None:
+            yield start, bounds["last"], notifications.filter(id__gte=start, id__lt=start + batch_size)
+            # Ranges without prunable rows (e.g. runs of unread notifications) are skipped.
+            start = notifications.filter(id__gte=start + batch_size).order_by("id").values_list("id", flat=True).first()
+
+
+    def handle(self, *args, **options):
+        if options["days"] < 0 or options["batch_size"] < 1:
+            raise CommandError("--days can't be negative and --batch-size has to be positive!")
+
+        notifications = Notification.objects.read_older_than(options["days"])
+
+        if options["dry_run"]:
+            self.stdout.write(f"{notifications.count()} read notifications older than {options['days']} days would be pruned.")
+            self.stdout.write(self.style.SUCCESS("Dry run, nothing was changed."))
+            return
+
+        archive = None
+        if options["archive"]:
+            opener = gzip.open if options["archive"].endswith(".gz") else open
+            archive = opener(options["archive"], "at", encoding="utf-8")
+
+        pruned = 0
+        start_time = time.perf_counter()
+        try:
+            for start, last, batch in self.batches(notifications, options["batch_size"]):
+                if archive:
+                    rows = list(batch.values("id", "user_id", "message", "is_read", "created_at"))
+                    # The rows are archived before they are deleted, a failed batch is archived again on the next run.
+                    archive.writelines(json.dumps(row, default=str) + "\n" for row in rows)
+                    archive.flush()
+                    deleted, _ = Notification.objects.filter(id__in=[row["id"] for row in rows]).delete()
+                else:
+                    deleted, _ = batch.delete()
+
+                pruned += deleted
+                if deleted:
+                    progress = min(start + options["batch_size"] - 1, last)
+                    self.stdout.write(f"Pruned {pruned} notifications (up to id {progress} of {last})")
+                if options["sleep"]:
+                    time.sleep(options["sleep"])
+        finally:
+            if archive:
+                archive.close()
+
+        elapsed = time.perf_counter() - start_time
+        action = "archived and deleted" if archive else "deleted"
+        self.stdout.write(self.style.SUCCESS(f"{pruned} notifications {action} in {elapsed:.2f}s."))
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.leaderboards import leaderboards
+from main.utils import get_redis_client
+
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the user and team leaderboards from the database."
+
+    def handle(self, *args, **options):
+        if get_redis_client() is None:
+            self.stdout.write(self.style.WARNING("Redis isn't configured, the leaderboards are kept per process "
+                                                 "and are built on first use anyway."))
+
+        start = time.perf_counter()
+        leaderboards.rebuild()
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ranked {len(leaderboards.users())} users and {len(leaderboards.teams())} teams in {elapsed:.2f}s."
+        ))
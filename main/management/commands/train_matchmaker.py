@@ -0,0 +1,78 @@
+import time
+import tracemalloc
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from main.learning_model.artifacts import activate, new_version, write_artifact
+from main.learning_model.train import STREAMING_TRAINERS
+
+
+User = get_user_model()
+
+
+
+class Command(BaseCommand):
+    help = "Trains the matchmaker from the users in the database and writes a versioned model artifact."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--index", choices=STREAMING_TRAINERS, default="knn")
+        parser.add_argument("--chunk-size", type=int, default=2000)
+        parser.add_argument("--no-activate", action="store_true",
+                            help="Write the versioned artifact without making it the served model.")
+        parser.add_argument("--report", action="store_true",
+                            help="Also compare the accuracy and latency of every index (loads all skills in memory).")
+
+
+    def read_chunks(self, chunk_size):
+        """
+        This method streams (skills, characters) chunks from the configured database,
+        using a server-side cursor where the backend supports it.
+        """
+        rows = User.objects.exclude(type="").values_list("skills", "type").iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return
+            self.users_count += len(chunk)
+            yield [skills.lower() for skills, _ in chunk], [user_type.lower() for _, user_type in chunk]
+
+
+    def handle(self, *args, **options):
+        self.users_count = 0
+        classes = [user_type.lower() for user_type, _ in User.CHARACTER_TYPES]
+        trainer = STREAMING_TRAINERS[options["index"]]
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        artifact = trainer(self.read_chunks(options["chunk_size"]), classes)
+        train_time = time.perf_counter() - start
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        if not self.users_count:
+            self.stderr.write("There are no users to train on!")
+            return
+
+        start = time.perf_counter()
+        version = new_version()
+        path = write_artifact(artifact, version)
+        if not options["no_activate"]:
+            activate(path, version)
+        write_time = time.perf_counter() - start
+
+        self.stdout.write(f"Users: {self.users_count}")
+        self.stdout.write(f"Read and fit: {train_time:.3f}s (peak memory {peak_memory / 2 ** 20:.1f} MiB)")
+        self.stdout.write(f"Write: {write_time:.3f}s")
+
+        if options["report"]:
+            from main.learning_model.benchmark import compare_indexes, print_report
+
+            skills, characters = [], []
+            for chunk_skills, chunk_characters in self.read_chunks(options["chunk_size"]):
+                skills.extend(chunk_skills)
+                characters.extend(chunk_characters)
+            print_report(compare_indexes(skills, characters), self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(f"Model written to {path}" + ("" if options["no_activate"] else " and activated")))
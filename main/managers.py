@@ -1,7 +1,14 @@
 from django.utils import timezone
 from datetime import timedelta
+from decimal import Decimal
 from django.contrib.auth.models import BaseUserManager
 from django.db import models
+from django.apps import apps
+from django.db.models import Case, When, Value, F, ExpressionWrapper, OuterRef, Subquery, Count
+from django.db.models.functions import Round, Coalesce, Cast
+
+from .teammates import get_teammate_ids
+from .notifications import unread_counts_changed
 
 
 
@@ -14,10 +21,60 @@ class RecentlyAddedMixin:
 
 
 
-class UserQuerySet(models.QuerySet, RecentlyAddedMixin):
+class RatingAggregateMixin:
+    """
+    Ratings are kept as a running score_sum and score_count, and the displayed average is derived from them.
+    add_ratings() applies new ratings with a single UPDATE of F() expressions, so concurrent ratings
+    never overwrite each other and no other column of the row is written.
+
+    The average is rounded half up to tenths in integer arithmetic, (20 * sum + count) // (2 * count),
+    which every database divides the same way (SQLite would otherwise turn a decimal division into an integer one).
+    """
+    average_field = None
+
+    def add_ratings(self, total, count=1):
+        # Rows rated before score_sum existed have a count but no sum (ratings are 1 to 5, so it can't be 0),
+        # their sum is rebuilt from the stored average in the same UPDATE.
+        legacy_sum = Cast(Round(F(self.average_field) * F("score_count")), models.IntegerField())
+        current_sum = Case(When(score_sum=0, score_count__gt=0, then=legacy_sum), default=F("score_sum"))
+        new_sum = current_sum + total
+        new_count = F("score_count") + count
+        tenths = ExpressionWrapper((new_sum * 20 + new_count) / (new_count * 2), output_field=models.IntegerField())
+        average = ExpressionWrapper(tenths * Value(Decimal("0.1")),
+                                    output_field=models.DecimalField(max_digits=3, decimal_places=1))
+        return self.update(score_sum=new_sum, score_count=new_count, **{self.average_field: Round(average, 1)})
+
+
+
+
+
+class UserQuerySet(models.QuerySet, RecentlyAddedMixin, RatingAggregateMixin):
+    average_field = "score"
+
     def available(self):
         return self.filter(is_available=True)
 
+    def search(self, term):
+        """Usernames containing the term, the ones starting with it first."""
+        rank = Case(When(username__istartswith=term, then=Value(0)), default=Value(1))
+        return self.filter(username__icontains=term).annotate(search_rank=rank).order_by("search_rank", "username")
+
+    def teammate_ids(self, user):
+        """The (cached) ids of the users sharing a team with the user."""
+        return get_teammate_ids(getattr(user, "pk", user))
+
+    def are_teammates(self, user, other):
+        return getattr(other, "pk", other) in self.teammate_ids(user)
+
+    def teammates_of(self, user):
+        return self.filter(pk__in=self.teammate_ids(user))
+
+    def refresh_unread_notifications(self):
+        """This method recounts the users' unread notifications with a single UPDATE."""
+        unread = (apps.get_model("main", "Notification").objects.filter(user=OuterRef("pk"), is_read=False)
+                  .order_by().values("user").annotate(count=Count("pk")).values("count"))
+        return self.update(unread_notifications=Coalesce(Subquery(unread), 0))
+
 
 class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
     pass
@@ -37,10 +94,36 @@ class TaskManager(models.Manager.from_queryset(TaskQuerySet)):
 
 
 
-class TeamQuerySet(models.QuerySet, RecentlyAddedMixin):
-    pass
+class TeamQuerySet(models.QuerySet, RecentlyAddedMixin, RatingAggregateMixin):
+    average_field = "teamwork_score"
 
 
 class TeamManager(models.Manager.from_queryset(TeamQuerySet)):
     pass
+    
+
+
+
 
+class NotificationQuerySet(models.QuerySet, RecentlyAddedMixin):
+    def unread(self):
+        return self.filter(is_read=False)
+
+    def mark_as_read(self):
+        """
+        This method marks the notifications as read with one UPDATE and returns how many were unread.
+        The unread counters of their users are then recounted.
+        """
+        user_ids = list(self.unread().order_by().values_list("user_id", flat=True).distinct())
+        updated = self.unread().update(is_read=True)
+        if updated:
+            unread_counts_changed(user_ids)
+        return updated
+
+    def read_older_than(self, days):
+        cutoff = timezone.now() - timedelta(days=days)
+        return self.filter(is_read=True, created_at__lt=cutoff)
+
+
+class NotificationManager(models.Manager.from_queryset(NotificationQuerySet)):
+    pass
@@ -4,14 +4,33 @@ from django.contrib.auth.models import AbstractUser
 from datetime import timedelta
 
 from .managers import (
-    UserManager, TaskManager, TeamManager,
+    UserManager, TaskManager, TeamManager, NotificationManager,
 )
 from .utils import avatar_upload_path_generator
 
-from .signals import invitation_acceptence, member_removal, leadership_invitation_acceptence
+from .signals import invitation_acceptence, member_removal, leadership_invitation_acceptence, score_changed
 
 
-class User(AbstractUser):
+
+class CounterFieldsMixin:
+    """
+    The counter fields of a model are only written by single-row F() updates (add_ratings(), the unread counters).
+    save() of an existing row without update_fields writes every other field, so an instance loaded
+    before such an update doesn't write its stale counters back over it.
+    """
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and kwargs.get("update_fields") is None and not kwargs.get("force_insert"):
+            kwargs["update_fields"] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.counter_fields]
+        return super().save(*args, **kwargs)
+
+
+
+class User(CounterFieldsMixin, AbstractUser):
+
+    counter_fields = ("score", "score_sum", "score_count", "unread_notifications")
 
     objects = UserManager()
 
@@ -34,25 +53,25 @@ class User(AbstractUser):
                                 validators=[MinValueValidator(1.0), MaxValueValidator(5.0)],
                                 null=True, blank=True
     )
+    score_sum = models.IntegerField(default=0)
     score_count = models.IntegerField(default=0)
+    unread_notifications = models.IntegerField(default=0)
     is_available = models.BooleanField(default=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
 
-    # BUG: Float precision error after many updates
     def calculate_new_score(self, new_score):
-        self.score_count += 1
-        if self.score:
-            self.score = (self.score * (self.score_count - 1) + new_score) / (self.score_count)
-        else:
-            self.score = new_score
-        self.save()
+        User.objects.filter(pk=self.pk).add_ratings(int(new_score))
+        self.refresh_from_db(fields=["score", "score_sum", "score_count"])
+
+        score_changed.send(sender=self.__class__, instance=self)
+
         return self.score
     
     
     def change_availability(self):
         self.is_available = not self.is_available
-        self.save()
+        self.save(update_fields=["is_available"])
     
     
     def __str__(self):
@@ -98,7 +117,7 @@ class Task(models.Model):
     def renew_deadline(self, extra_time):
         extra_time = int(extra_time)
         self.deadline += timedelta(days=extra_time)
-        self.save()
+        self.save(update_fields=["deadline"])
         return f"new deadline is {self.deadline}"
     
     def __str__(self):
@@ -107,7 +126,9 @@ class Task(models.Model):
 
 
 
-class Team(models.Model):
+class Team(CounterFieldsMixin, models.Model):
+
+    counter_fields = ("teamwork_score", "score_sum", "score_count")
 
     objects = TeamManager()
 
@@ -120,29 +141,27 @@ class Team(models.Model):
                                          validators=[MinValueValidator(1.0), MaxValueValidator(5.0)],
                                          null=True, blank=True
     )
+    score_sum = models.IntegerField(default=0)
     score_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def recalculate_teamwork_score(self, new_team_score):
-        self.score_count += 1
-        if self.teamwork_score:
-            self.teamwork_score = (self.teamwork_score * (self.score_count - 1) + int(new_team_score)) / (self.score_count)
-        else:
-            self.teamwork_score = new_team_score
-        self.save()
+        Team.objects.filter(pk=self.pk).add_ratings(int(new_team_score))
+        self.refresh_from_db(fields=["teamwork_score", "score_sum", "score_count"])
+
+        score_changed.send(sender=self.__class__, instance=self)
+
         return self.teamwork_score
 
     def add_member(self, user):
         if not self.members.filter(id=user.id).exists() and self.members.count() < self.max_members:
             self.members.add(user)
-            self.save()
             return f"new user{user.username} added to team {self.name}"
         return f"user already exists or team is full!"
 
     def remove_member(self, user):
         if self.members.filter(id=user.id).exists():
             self.members.remove(user)
-            self.save()
 
             member_removal.send(sender=self.__class__ , removed_user=user, team=self)
 
@@ -205,7 +224,7 @@ class LeaderShipInvitation(Invitation):
         if self.status == 'PENDING':
             self.team.add_member(self.invited_user)
             self.team.leader = self.invited_user
-            self.team.save()
+            self.team.save(update_fields=["leader"])
             self.status = 'ACCEPTED'
             self.save()
 
@@ -235,10 +254,17 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = NotificationManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-id"], name="notification_user_created_idx"),
+        ]
+
     def mark_as_read(self):
         if self.is_read == False:
+            Notification.objects.filter(pk=self.pk).mark_as_read()
             self.is_read = True
-            self.save()
             return f"user {self.user} has read the notification"
 
 
@@ -0,0 +1,159 @@
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F
+
+from .utils import push_notification, push_unread_count, get_notification_model
+
+
+
+def push_unread_counts(user_ids):
+    User = apps.get_model("main", "User")
+    for username, count in User.objects.filter(pk__in=list(user_ids)).values_list("username", "unread_notifications"):
+        push_unread_count(username, count)
+
+
+
+def unread_counts_changed(user_ids):
+    """
+    This function recounts the unread notifications of the given users and pushes the new counts
+    to their websockets once the surrounding transaction (if any) commits.
+    """
+    User = apps.get_model("main", "User")
+    User.objects.filter(pk__in=list(user_ids)).refresh_unread_notifications()
+    transaction.on_commit(lambda: push_unread_counts(user_ids))
+
+
+
+class NotificationBatch:
+    """This class collects notifications and their websocket pushes and writes them all at once."""
+
+    def __init__(self):
+        self.notifications = []
+        self.pushes = []
+
+
+    def add(self, user, message, push):
+        Notification = get_notification_model()
+        notification = Notification(user=user, message=message)
+        self.notifications.append(notification)
+        if push:
+            self.pushes.append((user.username, notification))
+
+
+    def flush(self):
+        """
+        This method writes the notifications with one bulk_create() and adds them to the users' unread counters
+        (one UPDATE per distinct number of new notifications), then sends the pushes and the new counts.
+        """
+        notifications, pushes = self.notifications, self.pushes
+        self.notifications, self.pushes = [], []
+        if notifications:
+            User = apps.get_model("main", "User")
+            new_counts = defaultdict(list)
+            for user_id, count in Counter(notification.user_id for notification in notifications).items():
+                new_counts[count].append(user_id)
+
+            with transaction.atomic():
+                get_notification_model().objects.bulk_create(notifications)
+                for count, user_ids in new_counts.items():
+                    User.objects.filter(pk__in=user_ids).update(unread_notifications=F("unread_notifications") + count)
+
+        for username, notification in pushes:
+            push_notification(username, notification.message, notification.id, notification.created_at)
+        if notifications:
+            push_unread_counts({notification.user_id for notification in notifications})
+
+
+
+_local = threading.local()
+
+
+def _transaction_batches(using):
+    if not hasattr(_local, "transaction_batches"):
+        _local.transaction_batches = {}
+    return _local.transaction_batches.setdefault(using, {})
+
+
+def _transaction_batch(using):
+    """
+    This function returns the batch of the innermost atomic block, registering its flush with on_commit().
+    Django drops the on_commit() callbacks of a rolled back block, so a batch whose flush isn't pending anymore
+    belongs to rolled back work: it is thrown away and a new batch is started.
+    """
+    connection = connections[using]
+    batches = _transaction_batches(using)
+    key = tuple(connection.savepoint_ids)
+
+    batch = batches.get(key)
+    if batch is not None and not any(callback is batch.flush_callback for _, callback, _ in connection.run_on_commit):
+        batch = None
+    if batch is None:
+        batch = NotificationBatch()
+        batches[key] = batch
+
+        def flush():
+            if batches.get(key) is batch:
+                del batches[key]
+            batch.flush()
+
+        batch.flush_callback = flush
+        transaction.on_commit(flush, using=using)
+    return batch
+
+
+
+def notify(user, message, push=False, using=DEFAULT_DB_ALIAS):
+    """
+    This function creates a notification for the user and optionally pushes it to the user's websocket.
+    Inside an atomic block, the notification is written (with one bulk_create() per block) and pushed
+    only after the transaction commits, nothing is written or pushed if it rolls back.
+    Outside one, it joins the current request's batch (see NotificationBatchMiddleware)
+    or is written right away.
+    """
+    if connections[using].in_atomic_block:
+        _transaction_batch(using).add(user, message, push)
+        return
+
+    request_batch = getattr(_local, "request_batch", None)
+    if request_batch is not None:
+        request_batch.add(user, message, push)
+        return
+
+    batch = NotificationBatch()
+    batch.add(user, message, push)
+    batch.flush()
+
+
+
+@contextmanager
+def notification_batch():
+    """
+    This context manager collects the notifications raised outside atomic blocks until it exits.
+    They describe autocommitted work, so they are written even if the block raises.
+    """
+    if getattr(_local, "request_batch", None) is not None:
+        yield _local.request_batch
+        return
+
+    batch = _local.request_batch = NotificationBatch()
+    try:
+        yield batch
+    finally:
+        _local.request_batch = None
+        batch.flush()
+
+
+
+class NotificationBatchMiddleware:
+    """This middleware writes the notifications of a request (outside atomic blocks) with a single query."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with notification_batch():
+            return self.get_response(request)
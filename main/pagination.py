@@ -1,7 +1,60 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+from datetime import datetime
 
+from django.db.models import Q
+from rest_framework.pagination import CursorPagination
 
-class NotificationViewSetPagination(PageNumberPagination):
+
+class NotificationViewSetPagination(CursorPagination):
+    """
+    Notifications are paginated by a cursor on (created_at, id) instead of page numbers,
+    so deep pages don't use OFFSET, no page issues a COUNT, and pages stay stable while new notifications arrive.
+    """
     page_size = 10
-    page_query_param = 'page_size'
+    page_size_query_param = 'page_size'
     max_page_size = 50
+    ordering = ('-created_at', '-id')
+
+
+
+def encode_cursor(item):
+    position = f"{item.created_at.isoformat()}|{item.id}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, item_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+
+def keyset_page(queryset, page_size, after=None, before=None):
+    """
+    This function returns one page of a queryset ordered newest first by (created_at, id), and
+    the cursors of the next (older) and previous (newer) pages, None when there is no such page.
+    "after" is the cursor of the last item of the page before, "before" the one of the first item of the page after.
+    The page is found by seeking the (user, created_at, id) index instead of counting and skipping rows.
+    """
+    position = decode_cursor(before or after or "")
+    if position and before:
+        created_at, item_id = position
+        newer = Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=item_id)
+        items = list(queryset.filter(newer).order_by("created_at", "id")[:page_size + 1])
+        has_newer = len(items) > page_size
+        items = items[:page_size][::-1]
+        has_older = True
+    else:
+        if position:
+            created_at, item_id = position
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=item_id))
+        items = list(queryset.order_by("-created_at", "-id")[:page_size + 1])
+        has_older = len(items) > page_size
+        items = items[:page_size]
+        has_newer = position is not None
+
+    next_cursor = encode_cursor(items[-1]) if items and has_older else None
+    previous_cursor = encode_cursor(items[0]) if items and has_newer else None
+    return items, next_cursor, previous_cursor
@@ -0,0 +1,228 @@
+import asyncio
+import threading
+import time
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.apps import apps
+
+from .streams import presence_group
+from .utils import get_redis_client
+
+
+
+class MemoryPresence:
+    """
+    This class is a per-process stand-in for the Redis presence keys, used when Redis isn't available.
+    Each user has the expiry times of their connections, a user is online while one hasn't expired.
+    """
+
+    def __init__(self):
+        self._connections = {}
+        self._lock = threading.Lock()
+
+
+    def _is_online(self, user_id, now):
+        connections = self._connections.get(user_id)
+        return bool(connections) and max(connections.values()) > now
+
+
+    def touch(self, user_id, connection, ttl):
+        now = time.monotonic()
+        with self._lock:
+            was_online = self._is_online(user_id, now)
+            if not was_online:
+                self._connections[user_id] = {}
+            self._connections[user_id][connection] = now + ttl
+        return not was_online
+
+
+    def leave(self, user_id, connection):
+        with self._lock:
+            connections = self._connections.get(user_id, {})
+            connections.pop(connection, None)
+            if self._is_online(user_id, time.monotonic()):
+                return False
+            return self._connections.pop(user_id, None) is not None
+
+
+    def online(self, user_ids):
+        now = time.monotonic()
+        with self._lock:
+            return {user_id for user_id in user_ids if self._is_online(user_id, now)}
+
+
+    def expired(self):
+        """This method forgets and returns the users whose connections all stopped sending heartbeats."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [user_id for user_id in self._connections if not self._is_online(user_id, now)]
+            for user_id in expired:
+                del self._connections[user_id]
+        return expired
+
+
+
+class RedisPresence:
+    """
+    This class keeps one Redis hash per online user, holding their connections.
+    Every heartbeat pushes the expiry of the whole key back, so a user is online exactly while the key exists:
+    it is removed with the last connection or expires when heartbeats stop (e.g. a crashed worker).
+    A sorted set keeps the expiry time of every online user, for finding the ones whose key expired.
+    """
+
+    def __init__(self, client, prefix):
+        self.client = client
+        self.prefix = prefix
+        self.expiries_key = f"{prefix}:expiries"
+
+
+    def key(self, user_id):
+        return f"{self.prefix}:{user_id}"
+
+
+    def touch(self, user_id, connection, ttl):
+        with self.client.pipeline() as pipeline:
+            existed, _, _, _ = pipeline.exists(self.key(user_id)).hset(self.key(user_id), connection, 1) \
+                                       .expire(self.key(user_id), ttl).zadd(self.expiries_key, {user_id: time.time() + ttl}).execute()
+        return not existed
+
+
+    def leave(self, user_id, connection):
+        with self.client.pipeline() as pipeline:
+            _, exists = pipeline.hdel(self.key(user_id), connection).exists(self.key(user_id)).execute()
+        # Only the connection that removes the user from the expiries announces them offline.
+        return not exists and bool(self.client.zrem(self.expiries_key, user_id))
+
+
+    def online(self, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        with self.client.pipeline(transaction=False) as pipeline:
+            for user_id in user_ids:
+                pipeline.exists(self.key(user_id))
+            return {user_id for user_id, exists in zip(user_ids, pipeline.execute()) if exists}
+
+
+    def expired(self):
+        """
+        This method removes and returns the users whose key expired. Every worker sweeps,
+        a user is returned by the one whose ZREM removed them.
+        """
+        candidates = [int(user_id) for user_id in self.client.zrangebyscore(self.expiries_key, "-inf", time.time())]
+        if not candidates:
+            return []
+        with self.client.pipeline(transaction=False) as pipeline:
+            for user_id in candidates:
+                pipeline.zrem(self.expiries_key, user_id)
+            claimed = [user_id for user_id, removed in zip(candidates, pipeline.execute()) if removed]
+        online = self.online(claimed)
+        return [user_id for user_id in claimed if user_id not in online]
+
+
+
+class Presence:
+    """
+    This class tracks which users have an open websocket. Connections refresh an expiring key per user
+    with their heartbeats, so checking whether a user is online is one key lookup.
+    Users going online or offline are announced to their teams' presence groups, every interval seconds
+    at most, with one {"online": [...], "offline": [...]} event per team instead of one per change.
+    While a process has open connections it also sweeps, every interval seconds, the users whose heartbeats
+    stopped without a disconnect (a dropped client, a crashed worker) and announces them offline.
+    """
+
+    KEY_PREFIX = "presence"
+
+    def __init__(self, ttl=60, interval=5.0):
+        self.ttl = ttl
+        self.interval = interval
+        self._store = None
+        self._changes = {}
+        self._flush_loop = None
+        self._connections = set()
+        self._sweep_loop = None
+
+
+    def store(self):
+        if self._store is None:
+            client = get_redis_client()
+            self._store = RedisPresence(client, self.KEY_PREFIX) if client else MemoryPresence()
+        return self._store
+
+
+    def touch(self, user_id, connection):
+        """This method records a connection's heartbeat and returns whether the user just came online."""
+        self._connections.add(connection)
+        return self.store().touch(user_id, connection, self.ttl)
+
+
+    def leave(self, user_id, connection):
+        """This method forgets a closed connection and returns whether the user just went offline."""
+        self._connections.discard(connection)
+        return self.store().leave(user_id, connection)
+
+
+    def online(self, user_ids):
+        return self.store().online(user_ids)
+
+
+    def announce(self, user_id, team_ids, online):
+        """
+        This method queues a presence change for the next update of the user's teams. It runs on the event loop,
+        the changes queued within one interval are sent together, the last change of a user wins.
+        """
+        for team_id in team_ids:
+            self._changes.setdefault(team_id, {})[user_id] = online
+
+        loop = asyncio.get_running_loop()
+        if self._flush_loop is None or self._flush_loop.is_closed():
+            self._flush_loop = loop
+            loop.call_later(self.interval, lambda: loop.create_task(self.flush()))
+
+
+    def expired_memberships(self):
+        """This method returns the teams of every user whose heartbeats expired, {user_id: [team_id, ...]}."""
+        expired = self.store().expired()
+        teams = {user_id: [] for user_id in expired}
+        if expired:
+            Membership = apps.get_model("main", "Team").members.through
+            for user_id, team_id in Membership.objects.filter(user_id__in=expired).values_list("user_id", "team_id"):
+                teams[user_id].append(team_id)
+        return teams
+
+
+    def start_sweeping(self):
+        loop = asyncio.get_running_loop()
+        if self._sweep_loop is None or self._sweep_loop.is_closed():
+            self._sweep_loop = loop
+            loop.create_task(self.sweep())
+
+
+    async def sweep(self):
+        try:
+            while self._connections:
+                await asyncio.sleep(self.interval)
+                for user_id, team_ids in (await database_sync_to_async(self.expired_memberships)()).items():
+                    self.announce(user_id, team_ids, online=False)
+        finally:
+            self._sweep_loop = None
+
+
+    async def flush(self):
+        changes, self._changes = self._changes, {}
+        self._flush_loop = None
+
+        channel_layer = get_channel_layer()
+        await asyncio.gather(*(
+            channel_layer.group_send(presence_group(team_id), {
+                "type": "stream_event", "stream": "presence", "team_id": team_id, "payload": {
+                    "online": sorted(user_id for user_id, online in users.items() if online),
+                    "offline": sorted(user_id for user_id, online in users.items() if not online),
+                }})
+            for team_id, users in changes.items()
+        ))
+
+
+
+presence = Presence()
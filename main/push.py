@@ -0,0 +1,154 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+
+logger = logging.getLogger(__name__)
+
+
+
+class PushQueue:
+    """
+    This class sends channel layer events from a background event loop instead of the thread that raised them,
+    so a request or a signal handler never waits on the channel layer.
+    Events are queued once their transaction commits and sent every window seconds: the events queued for
+    one group meanwhile go out as a single "push_batch" event (of at most max_batch events), which consumers
+    send as one websocket frame, and the sends of one window run concurrently.
+    With window 0 every event is sent right away from the calling thread.
+    The queued events are flushed when the process exits (e.g. at the end of a management command).
+    """
+
+    def __init__(self, window=0.05, max_batch=50, latency_samples=1000):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._loop = None
+        self._loop_pid = None
+        self._flush_lock = None
+        self._flush_scheduled = False
+        self._latencies = deque(maxlen=latency_samples)
+
+        self.depth = 0
+        self.max_depth = 0
+        self.sent_events = 0
+        self.sent_messages = 0
+        self.failed = 0
+
+
+    def push(self, group_name, event):
+        """This method queues an event for a group once the surrounding transaction (if any) commits."""
+        transaction.on_commit(lambda: self.enqueue(group_name, event))
+
+
+    def enqueue(self, group_name, event):
+        if not self.window:
+            queued_at = time.perf_counter()
+            async_to_sync(get_channel_layer().group_send)(group_name, event)
+            self._record_sent([queued_at])
+            return
+
+        with self._lock:
+            self._pending.setdefault(group_name, []).append((event, time.perf_counter()))
+            self.depth += 1
+            self.max_depth = max(self.max_depth, self.depth)
+            schedule, self._flush_scheduled = not self._flush_scheduled, True
+        if schedule:
+            loop = self._get_loop()
+            loop.call_soon_threadsafe(loop.call_later, self.window, lambda: loop.create_task(self.flush()))
+
+
+    def _get_loop(self):
+        # A forked worker doesn't inherit the parent's loop thread, it starts its own.
+        with self._lock:
+            if self._loop is None or self._loop_pid != os.getpid():
+                self._loop = asyncio.new_event_loop()
+                self._loop_pid = os.getpid()
+                self._flush_lock = asyncio.Lock()
+                threading.Thread(target=self._loop.run_forever, name="push-queue", daemon=True).start()
+            return self._loop
+
+
+    async def flush(self):
+        """
+        This method sends the queued events, one channel layer message per group (and max_batch events).
+        Flushes run one at a time, so the events of a group are sent in the order they were queued.
+        """
+        async with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._flush_scheduled = False
+
+            messages = []
+            for group_name, items in pending.items():
+                for start in range(0, len(items), self.max_batch):
+                    chunk = items[start:start + self.max_batch]
+                    event = chunk[0][0] if len(chunk) == 1 else {"type": "push_batch", "events": [item[0] for item in chunk]}
+                    messages.append((group_name, event, [item[1] for item in chunk]))
+
+            channel_layer = get_channel_layer()
+            results = await asyncio.gather(*(channel_layer.group_send(group_name, event) for group_name, event, _ in messages),
+                                           return_exceptions=True)
+
+            for (group_name, _, queued_at), result in zip(messages, results):
+                if isinstance(result, Exception):
+                    logger.warning("Pushing %d events to %s failed: %r", len(queued_at), group_name, result)
+                    with self._lock:
+                        self.depth -= len(queued_at)
+                        self.failed += len(queued_at)
+                else:
+                    self._record_sent(queued_at, queued=True)
+
+
+    def close(self, timeout=5.0):
+        """This method sends the queued events now and waits for them, the background loop dies with the process."""
+        with self._lock:
+            loop = self._loop if self._loop_pid == os.getpid() else None
+        if loop is None or loop.is_closed():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.flush(), loop).result(timeout)
+        except Exception:
+            logger.warning("Flushing %d queued pushes at exit failed", self.depth, exc_info=True)
+
+
+    def _record_sent(self, queued_at, queued=False):
+        now = time.perf_counter()
+        with self._lock:
+            if queued:
+                self.depth -= len(queued_at)
+            self.sent_events += len(queued_at)
+            self.sent_messages += 1
+            self._latencies.extend(now - start for start in queued_at)
+
+
+    def stats(self):
+        """
+        This method returns the queue depth and the latency (from commit to sent) of the last sent events.
+        sent_events - sent_messages is the number of channel layer sends saved by batching.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                "depth": self.depth,
+                "max_depth": self.max_depth,
+                "sent_events": self.sent_events,
+                "sent_messages": self.sent_messages,
+                "failed": self.failed,
+                "mean_latency": sum(latencies) / len(latencies) if latencies else None,
+                "p95_latency": latencies[int(len(latencies) * 0.95)] if latencies else None,
+                "max_latency": latencies[-1] if latencies else None,
+            }
+
+
+
+push_queue = PushQueue()
+atexit.register(push_queue.close)
@@ -0,0 +1,191 @@
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import Q, Sum, Count
+
+from .models import User, Team, UserRating, TeamRating
+from .signals import score_changed
+
+
+
+class RatingError(Exception):
+    pass
+
+
+
+def lock_rater(rater):
+    """
+    This function locks the rater's row until the surrounding transaction ends. Every rating row conflicts
+    only with ratings of the same rater, so every path that saves ratings takes this lock first:
+    a rater's submissions run one at a time and a "rated before" check made under the lock is exact.
+    """
+    User.objects.select_for_update().filter(pk=rater.pk).exists()
+
+
+
+def _apply_aggregates(model, ratings):
+    """
+    This function adds {entity_id: [rating, ...]} to the entities' score aggregates.
+    Entities that receive the same (total, count) share one UPDATE, so a whole end-of-project round
+    of ratings (mostly one rating of 1-5 per entity) needs at most a handful of statements.
+    """
+    groups = defaultdict(list)
+    for entity_id, values in ratings.items():
+        groups[(sum(values), len(values))].append(entity_id)
+    for (total, count), entity_ids in groups.items():
+        model.objects.filter(pk__in=entity_ids).add_ratings(total, count)
+
+
+
+def submit_ratings(rater, user_ratings, team_ratings):
+    """
+    This function saves a batch of ratings from one rater: user_ratings and team_ratings map
+    the rated user/team ids to a rating of 1-5.
+    Co-membership of every rated user and team is checked with a single query and nothing is saved
+    if any of them isn't shared with the rater. Entities rated before are skipped.
+    It returns the ids of the rated users and teams and the ids of the skipped ones.
+    """
+    if rater.id in user_ratings:
+        raise RatingError("You can't rate yourself!")
+
+    Membership = Team.members.through
+    memberships = (Membership.objects.filter(team__members=rater)
+                   .filter(Q(user_id__in=list(user_ratings)) | Q(team_id__in=list(team_ratings)))
+                   .values_list("team_id", "user_id"))
+    teammate_ids, team_ids = set(), set()
+    for team_id, user_id in memberships:
+        teammate_ids.add(user_id)
+        team_ids.add(team_id)
+
+    strangers = sorted(set(user_ratings) - teammate_ids)
+    foreign_teams = sorted(set(team_ratings) - team_ids)
+    if strangers or foreign_teams:
+        raise RatingError({"message": "You can only rate your teammates and your teams!",
+                           "users": strangers, "teams": foreign_teams})
+
+    with transaction.atomic():
+        lock_rater(rater)
+
+        rated_users = set(UserRating.objects.filter(rater=rater, rated_id__in=list(user_ratings))
+                          .values_list("rated_id", flat=True))
+        rated_teams = set(TeamRating.objects.filter(user=rater, team_id__in=list(team_ratings))
+                          .values_list("team_id", flat=True))
+        new_user_ratings = {user_id: rating for user_id, rating in user_ratings.items() if user_id not in rated_users}
+        new_team_ratings = {team_id: rating for team_id, rating in team_ratings.items() if team_id not in rated_teams}
+
+        # No conflict is ignored: a row that isn't inserted must not reach the aggregates either.
+        UserRating.objects.bulk_create([UserRating(rater=rater, rated_id=user_id, rating=rating)
+                                        for user_id, rating in new_user_ratings.items()])
+        TeamRating.objects.bulk_create([TeamRating(user=rater, team_id=team_id, rating=rating)
+                                        for team_id, rating in new_team_ratings.items()])
+
+        _apply_aggregates(User, {user_id: [rating] for user_id, rating in new_user_ratings.items()})
+        _apply_aggregates(Team, {team_id: [rating] for team_id, rating in new_team_ratings.items()})
+
+        def announce():
+            for user in User.objects.filter(pk__in=list(new_user_ratings)):
+                score_changed.send(sender=User, instance=user)
+            for team in Team.objects.filter(pk__in=list(new_team_ratings)):
+                score_changed.send(sender=Team, instance=team)
+
+        transaction.on_commit(announce)
+
+    return {
+        "rated_users": sorted(new_user_ratings),
+        "rated_teams": sorted(new_team_ratings),
+        "skipped_users": sorted(rated_users),
+        "skipped_teams": sorted(rated_teams),
+    }
+
+
+
+# (rated model, rating model, rating foreign key, average field)
+AGGREGATES = {
+    "users": (User, UserRating, "rated_id", "score"),
+    "teams": (Team, TeamRating, "team_id", "teamwork_score"),
+}
+
+
+
+def expected_average(total, count):
+    if not count:
+        return None
+    return (Decimal(total) / count).quantize(Decimal("0.1"), rounding=ROUND_HALF_UP)
+
+
+
+def _merge_aggregates(entities, aggregates):
+    """
+    This function merge-joins two streams ordered by id: (id, sum, count, average) rows of the rated entities
+    and (id, total, count) rows of their grouped ratings. It yields (id, stored, expected) for every entity,
+    entities without ratings expecting (0, 0, None).
+    """
+    aggregate = next(aggregates, None)
+    for entity_id, *stored in entities:
+        while aggregate is not None and aggregate[0] < entity_id:
+            aggregate = next(aggregates, None)
+        if aggregate is not None and aggregate[0] == entity_id:
+            total, count = aggregate[1], aggregate[2]
+        else:
+            total, count = 0, 0
+        yield entity_id, tuple(stored), (total, count, expected_average(total, count))
+
+
+
+def _fix_drift(model, rating_model, key, average_field, entity_ids):
+    """
+    This function rewrites the aggregates of the given entities under a row lock.
+    Their ratings are aggregated again after the lock is taken: a rating committed since the scan is counted,
+    and a rating still being submitted adds itself (F() update) on top of the corrected row once the lock is released.
+    """
+    with transaction.atomic():
+        entities = list(model.objects.select_for_update().filter(pk__in=entity_ids).order_by("pk")
+                        .only("pk", "score_sum", "score_count", average_field))
+        totals = {row[key]: (row["total"], row["count"]) for row in
+                  rating_model.objects.filter(**{f"{key}__in": entity_ids}).values(key)
+                  .annotate(total=Sum("rating"), count=Count("id")).order_by()}
+        for entity in entities:
+            total, count = totals.get(entity.pk, (0, 0))
+            entity.score_sum, entity.score_count = total, count
+            setattr(entity, average_field, expected_average(total, count))
+        model.objects.bulk_update(entities, ["score_sum", "score_count", average_field])
+    return entities
+
+
+
+def recompute_aggregates(name, chunk_size=2000, dry_run=False):
+    """
+    This function compares the stored rating aggregates of users or teams ("users"/"teams")
+    with their rating rows and fixes the ones that drifted.
+    The entity table and one grouped aggregate of the rating table are streamed side by side in id order,
+    so memory stays bounded by chunk_size whatever the number of ratings. Drifted rows are fixed chunk by chunk.
+    It returns a report of the drift found.
+    """
+    model, rating_model, key, average_field = AGGREGATES[name]
+    entities = (model.objects.order_by("pk").values_list("pk", "score_sum", "score_count", average_field)
+                .iterator(chunk_size=chunk_size))
+    aggregates = (rating_model.objects.values(key).annotate(total=Sum("rating"), count=Count("id")).order_by(key)
+                  .values_list(key, "total", "count").iterator(chunk_size=chunk_size))
+
+    report = {"checked": 0, "drifted": 0, "fixed": 0, "count_drift": 0, "max_average_drift": Decimal("0")}
+    drifted_ids = []
+
+    def flush():
+        if not dry_run and drifted_ids:
+            report["fixed"] += len(_fix_drift(model, rating_model, key, average_field, drifted_ids))
+        drifted_ids.clear()
+
+    for entity_id, stored, expected in _merge_aggregates(entities, aggregates):
+        report["checked"] += 1
+        if stored == expected:
+            continue
+        report["drifted"] += 1
+        report["count_drift"] += abs(stored[1] - expected[1])
+        if stored[2] is not None and expected[2] is not None:
+            report["max_average_drift"] = max(report["max_average_drift"], abs(stored[2] - expected[2]))
+        drifted_ids.append(entity_id)
+        if len(drifted_ids) >= chunk_size:
+            flush()
+    flush()
+    return report
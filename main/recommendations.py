@@ -0,0 +1,170 @@
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.contrib.auth import get_user_model
+
+from .learning_model.matchmaker import TOKEN_PATTERN
+
+
+
+class UserFeatureMatrix:
+    """
+    This class keeps every user's recommendation features in flat NumPy arrays, one row per user:
+    the character type, the score, availability and the user's skill tokens hashed into
+    a fixed-width row of column ids (padded), so a whole team can be scored against every
+    user with a few vectorized operations instead of a query per candidate.
+
+    The matrix is built from the database on first use and then updated in place by
+    user post_save/post_delete signals. It is rebuilt after max_age seconds to pick up
+    changes made by other processes.
+    """
+
+    N_FEATURES = 2 ** 12
+    MAX_TOKENS = 16
+
+    WEIGHTS = {"type": 0.4, "novelty": 0.25, "shared": 0.1, "score": 0.25}
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self.type_index = None
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._reset(capacity=0)
+
+
+    def _reset(self, capacity):
+        self.size = 0
+        self.positions = {}
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.types = np.full(capacity, -1, dtype=np.int8)
+        self.scores = np.full(capacity, np.nan, dtype=np.float32)
+        self.available = np.zeros(capacity, dtype=bool)
+        self.token_counts = np.zeros(capacity, dtype=np.int16)
+        # Padding points at the extra, never-set column N_FEATURES of a team's token mask.
+        self.tokens = np.full((capacity, self.MAX_TOKENS), self.N_FEATURES, dtype=np.int32)
+
+
+    def _grow(self, capacity):
+        grown = {
+            "ids": np.zeros(capacity, dtype=np.int64),
+            "types": np.full(capacity, -1, dtype=np.int8),
+            "scores": np.full(capacity, np.nan, dtype=np.float32),
+            "available": np.zeros(capacity, dtype=bool),
+            "token_counts": np.zeros(capacity, dtype=np.int16),
+            "tokens": np.full((capacity, self.MAX_TOKENS), self.N_FEATURES, dtype=np.int32),
+        }
+        for name, array in grown.items():
+            array[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, array)
+
+
+    def hash_skills(self, skills):
+        columns = {zlib.crc32(token.encode()) % self.N_FEATURES for token in TOKEN_PATTERN.findall((skills or "").lower())}
+        return sorted(columns)[:self.MAX_TOKENS]
+
+
+    def _set_row(self, user_id, user_type, skills, score, is_available):
+        row = self.positions.get(user_id)
+        if row is None:
+            if self.size == len(self.ids):
+                self._grow(max(1024, 2 * len(self.ids)))
+            row = self.size
+            self.size += 1
+            self.positions[user_id] = row
+
+        columns = self.hash_skills(skills)
+        self.ids[row] = user_id
+        self.types[row] = self.type_index.get((user_type or "").upper(), -1)
+        self.scores[row] = np.nan if score is None else float(score)
+        self.available[row] = is_available
+        self.token_counts[row] = len(columns)
+        self.tokens[row] = self.N_FEATURES
+        self.tokens[row, :len(columns)] = columns
+
+
+    def build(self):
+        User = get_user_model()
+        users = User.objects.values_list("id", "type", "skills", "score", "is_available", "is_superuser")
+        with self._lock:
+            self.type_index = {user_type: index for index, (user_type, _) in enumerate(User.CHARACTER_TYPES)}
+            self._reset(capacity=1024)
+            for user_id, user_type, skills, score, is_available, is_superuser in users.iterator(chunk_size=2000):
+                self._set_row(user_id, user_type, skills, score, is_available and not is_superuser)
+            self._built_at = time.monotonic()
+
+
+    def ensure_fresh(self):
+        if self._built_at is None or time.monotonic() - self._built_at > self.max_age:
+            self.build()
+
+
+    def update_user(self, user):
+        """This method refreshes one user's row, if the matrix has been built already."""
+        with self._lock:
+            if self._built_at is not None:
+                self._set_row(user.id, user.type, user.skills, user.score, user.is_available and not user.is_superuser)
+
+
+    def remove_user(self, user_id):
+        with self._lock:
+            row = self.positions.get(user_id)
+            if row is not None:
+                self.available[row] = False
+
+
+    def recommend(self, member_ids, k=10, exclude_ids=()):
+        """
+        This method returns the top-k (user_id, match) pairs for a team with the given members.
+        A candidate's match mixes:
+            - type: how rare the candidate's character type is among the members,
+            - novelty: the share of the candidate's skills the team doesn't have yet,
+            - shared: whether the candidate has at least one skill in common with the team,
+            - score: the candidate's rating (unrated users count as average).
+        """
+        self.ensure_fresh()
+        with self._lock:
+            size = self.size
+            types = self.types[:size]
+            token_counts = self.token_counts[:size]
+            tokens = self.tokens[:size]
+
+            member_rows = [self.positions[user_id] for user_id in member_ids if user_id in self.positions]
+
+            type_counts = np.bincount(types[member_rows][types[member_rows] >= 0], minlength=len(self.type_index))
+            type_match = np.where(types >= 0, 1.0 / (1.0 + type_counts[types]), 0.5)
+
+            team_mask = np.zeros(self.N_FEATURES + 1, dtype=bool)
+            team_mask[tokens[member_rows].ravel()] = True
+            team_mask[self.N_FEATURES] = False
+            overlap = team_mask[tokens].sum(axis=1)
+            novelty = (token_counts - overlap) / np.maximum(token_counts, 1)
+            shared = overlap > 0
+
+            scores = self.scores[:size]
+            known_scores = scores[~np.isnan(scores)]
+            default_score = known_scores.mean() if len(known_scores) else 3.0
+            score_match = np.where(np.isnan(scores), default_score, scores) / 5.0
+
+            match = (self.WEIGHTS["type"] * type_match + self.WEIGHTS["novelty"] * novelty
+                     + self.WEIGHTS["shared"] * shared + self.WEIGHTS["score"] * score_match)
+
+            candidates = self.available[:size].copy()
+            candidates[member_rows] = False
+            for user_id in exclude_ids:
+                row = self.positions.get(user_id)
+                if row is not None:
+                    candidates[row] = False
+            match = np.where(candidates, match, -np.inf)
+
+            k = min(k, int(candidates.sum()))
+            if k <= 0:
+                return []
+            top = np.argpartition(-match, k - 1)[:k]
+            top = top[np.argsort(-match[top], kind="stable")]
+            return [(int(self.ids[row]), float(match[row])) for row in top]
+
+
+
+user_features = UserFeatureMatrix()
@@ -0,0 +1,49 @@
+import hashlib
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections
+
+
+SEARCH_LIMIT = 10
+SEARCH_CACHE_TIMEOUT = 30
+
+
+
+
+def search_users(term, limit=SEARCH_LIMIT):
+    """
+    This function returns up to limit {"id", "username"} dicts for a typeahead,
+    usernames starting with the term first. Hot prefixes are cached for a few seconds.
+    """
+    term = term.strip()
+    if not term:
+        return []
+
+    cache_key = f"user_search:{limit}:{hashlib.md5(term.lower().encode()).hexdigest()}"
+    result = cache.get(cache_key)
+    if result is None:
+        User = get_user_model()
+        result = list(User.objects.search(term).values("id", "username")[:limit])
+        cache.set(cache_key, result, timeout=SEARCH_CACHE_TIMEOUT)
+    return result
+
+
+
+def create_search_indexes(using="default", **kwargs):
+    """
+    This function creates the index that keeps username__icontains / __istartswith fast.
+    Django compiles those lookups to UPPER("username"::text) LIKE ... on PostgreSQL, which a trigram GIN index
+    on the same expression serves for substrings too. SQLite only optimizes LIKE 'prefix%' on a NOCASE index.
+    It runs after every migrate (post_migrate) and is idempotent.
+    """
+    connection = connections[using]
+    table = get_user_model()._meta.db_table
+
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS main_user_username_trgm ON "{table}" '
+                           f'USING gin ((UPPER("username"::text)) gin_trgm_ops)')
+        elif connection.vendor == "sqlite":
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS main_user_username_nocase ON "{table}" ("username" COLLATE NOCASE)')
@@ -20,6 +20,10 @@ class SendTeamInvitationSerializer(serializers.Serializer):
         return user_id
 
 
+class RecommendTeammatesSerializer(serializers.Serializer):
+    k = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+
 class InvitationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Invitation
@@ -29,6 +33,10 @@ class InvitationSerializer(serializers.ModelSerializer):
 class RemoveMemberSerializer(serializers.Serializer):
     username_to_remove = serializers.CharField()
 
+class UserSearchSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=20)
+    limit = serializers.IntegerField(min_value=1, max_value=20, default=10)
+
 # FIXME: UserSerializer allows writing to email and score fields
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -51,3 +59,49 @@ class NotificationSerializer(serializers.ModelSerializer):
         model = Notification
         fields = "__all__"
 
+
+class UserRatingItemSerializer(serializers.Serializer):
+    user_id = serializers.IntegerField(min_value=1)
+    rating = serializers.IntegerField(min_value=1, max_value=5)
+
+
+class TeamRatingItemSerializer(serializers.Serializer):
+    team_id = serializers.IntegerField(min_value=1)
+    rating = serializers.IntegerField(min_value=1, max_value=5)
+
+
+class BulkRatingSerializer(serializers.Serializer):
+    users = UserRatingItemSerializer(many=True, required=False, max_length=100)
+    teams = TeamRatingItemSerializer(many=True, required=False, max_length=100)
+
+    def validate(self, data):
+        users, teams = data.get("users", []), data.get("teams", [])
+        if not users and not teams:
+            raise serializers.ValidationError("There is nothing to rate!")
+        if len({item["user_id"] for item in users}) < len(users) or len({item["team_id"] for item in teams}) < len(teams):
+            raise serializers.ValidationError("Each user and team can only be rated once!")
+        return data
+
+
+class LeaderboardSerializer(serializers.Serializer):
+    type = serializers.ChoiceField(choices=[user_type for user_type, _ in User.CHARACTER_TYPES], required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    offset = serializers.IntegerField(min_value=0, default=0)
+
+    def to_internal_value(self, data):
+        if "type" in data:
+            data = data.copy()
+            data["type"] = str(data["type"]).upper()
+        return super().to_internal_value(data)
+
+
+class MarkNotificationsAsReadSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=1000)
+
+
+class DeleteReadNotificationsSerializer(serializers.Serializer):
+    older_than_days = serializers.IntegerField(min_value=0, default=30)
+
+
+class PredictUserTypesSerializer(serializers.Serializer):
+    skills = serializers.ListField(child=serializers.CharField(max_length=100), allow_empty=False, max_length=1000)
@@ -1,45 +1,232 @@
-from django.db.models.signals import post_save
+import copy
+
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete, m2m_changed, ModelSignal
 from django.dispatch import receiver, Signal
-from .utils import push_notification, get_notification_model
+from .notifications import notify
+from .recommendations import user_features
+from .teammates import invalidate_team_members
+from .leaderboards import leaderboards
+from .streams import publish, publish_membership, team_group, invitations_group
 
 
 
 @receiver(post_save, sender='main.Task')
 def notify_task_creation(sender, instance, created, **kwargs):
     if created:
-        Notification = get_notification_model()
-        Notification.objects.create(user=instance.created_by, message=f"Task '{instance.title}' created!")
-        push_notification(instance.created_by.username, f"Task {instance.title} created!")
+        notify(instance.created_by, f"Task '{instance.title}' created!", push=True)
 
 
 
 @receiver(post_save, sender='main.Invitation')
 def notify_invitation_creation(sender, instance, created, **kwargs):
     if created:
-        Notification = get_notification_model()
-        Notification.objects.create(user=instance.invited_user, message=f"You are invited to the team {instance.team}!")
+        notify(instance.invited_user, f"You are invited to the team {instance.team}!")
 
 
 
 invitation_acceptence = Signal()
 @receiver(invitation_acceptence)
 def notify_invitation_acceptance(sender, instance, result, **kwargs):
-    Notification = get_notification_model()
-    Notification.objects.create(user=instance.invited_by,
-                                message=f"User {instance.invited_user.username} {result} the invitation for the team {instance.team.name}")
+    notify(instance.invited_by, f"User {instance.invited_user.username} {result} the invitation for the team {instance.team.name}")
 
 
 member_removal = Signal()
 @receiver(member_removal)
 def notify_member_removal(sender, removed_user, team, **kwargs):
-    Notification = get_notification_model()
-    Notification.objects.create(user=removed_user, message=f"You are removed from the team {team.name}!")
+    notify(removed_user, f"You are removed from the team {team.name}!")
 
 
 
 leadership_invitation_acceptence = Signal()
 @receiver(leadership_invitation_acceptence)
 def notify_leadership_acceptence(sender, instance, result, **kwargs):
-    Notification = get_notification_model()
-    Notification.objects.create(user=instance.invited_by,
-                                message=f"User {instance.invited_user.username} {result} the leadership invitaion for the team {instance.team.name}")
+    notify(instance.invited_by, f"User {instance.invited_user.username} {result} the leadership invitaion for the team {instance.team.name}")
+
+
+
+def saved_fields_include(update_fields, fields):
+    return update_fields is None or not fields.isdisjoint(update_fields)
+
+
+def with_stored_score(sender, instance):
+    """
+    This function returns a copy of a saved user with the score stored in the database. Saves don't write
+    the score (it is a counter field), so the instance may hold a score from before later ratings.
+    """
+    user = copy.copy(instance)
+    stored = sender.objects.filter(pk=instance.pk).values("score", "score_count").first()
+    if stored:
+        user.score, user.score_count = stored["score"], stored["score_count"]
+    return user
+
+
+@receiver(post_save, sender='main.User')
+def refresh_user_features(sender, instance, created, update_fields=None, **kwargs):
+    if created:
+        user_features.update_user(instance)
+    elif saved_fields_include(update_fields, {"type", "skills", "is_available", "is_superuser", "score"}):
+        user_features.update_user(with_stored_score(sender, instance))
+
+
+@receiver(post_delete, sender='main.User')
+def drop_user_features(sender, instance, **kwargs):
+    user_features.remove_user(instance.id)
+
+
+
+score_changed = ModelSignal(use_caching=True)
+@receiver(score_changed, sender='main.User')
+def refresh_rated_user_features(sender, instance, **kwargs):
+    user_features.update_user(instance)
+
+
+@receiver(score_changed, sender='main.User')
+def rank_rated_user(sender, instance, **kwargs):
+    leaderboards.record_user(instance)
+
+
+@receiver(score_changed, sender='main.Team')
+def rank_rated_team(sender, instance, **kwargs):
+    leaderboards.record_team(instance)
+
+
+@receiver(post_save, sender='main.User')
+def rerank_saved_user(sender, instance, created, update_fields=None, **kwargs):
+    # A saved rated user may have changed type or become a superuser.
+    if not created and saved_fields_include(update_fields, {"type", "is_superuser", "score"}):
+        user = with_stored_score(sender, instance)
+        if user.score_count:
+            leaderboards.record_user(user)
+
+
+@receiver(post_delete, sender='main.User')
+def unrank_deleted_user(sender, instance, **kwargs):
+    leaderboards.remove_user(instance.id)
+
+
+@receiver(post_delete, sender='main.Team')
+def unrank_deleted_team(sender, instance, **kwargs):
+    leaderboards.remove_team(instance.id)
+
+
+
+@receiver(m2m_changed, sender='main.Team_members')
+def invalidate_changed_teammates(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    # Forward: instance is the team and pk_set the users. Reverse (user.teams): instance is the user.
+    if reverse:
+        team_ids = pk_set if action != "pre_clear" else instance.teams.values_list("id", flat=True)
+        invalidate_team_members(team_ids, extra_user_ids=[instance.pk])
+    else:
+        invalidate_team_members([instance.pk], extra_user_ids=pk_set or ())
+
+
+@receiver(m2m_changed, sender='main.Team_members')
+def publish_changed_membership(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    # Reverse (user.teams): instance is the user and model the Team, forward the other way around.
+    if reverse:
+        members = {instance.pk: instance.username}
+        teams = instance.teams.all() if action == "pre_clear" else model.objects.filter(pk__in=pk_set)
+        teams = dict(teams.values_list("id", "name"))
+    else:
+        teams = {instance.pk: instance.name}
+        members = instance.members.all() if action == "pre_clear" else model.objects.filter(pk__in=pk_set)
+        members = dict(members.values_list("id", "username"))
+    if teams and members:
+        publish_membership(teams, members, joined=action == "post_add")
+
+
+@receiver(pre_delete, sender='main.Team')
+def invalidate_deleted_team_members(sender, instance, **kwargs):
+    invalidate_team_members([instance.pk])
+
+
+@receiver(pre_delete, sender='main.User')
+def invalidate_deleted_user_teammates(sender, instance, **kwargs):
+    invalidate_team_members(instance.teams.values_list("id", flat=True), extra_user_ids=[instance.pk])
+
+
+@receiver(pre_delete, sender='main.Team')
+def publish_deleted_team_members(sender, instance, **kwargs):
+    # Deleting a team removes its memberships without m2m_changed.
+    members = dict(instance.members.values_list("id", "username"))
+    if members:
+        publish_membership({instance.pk: instance.name}, members, joined=False)
+
+
+@receiver(pre_delete, sender='main.User')
+def publish_deleted_user_memberships(sender, instance, **kwargs):
+    teams = dict(instance.teams.values_list("id", "name"))
+    if teams:
+        publish_membership(teams, {instance.pk: instance.username}, joined=False)
+
+
+
+
+def task_payload(task):
+    return {"id": task.id, "title": task.title, "status": task.status, "task_type": task.task_type,
+            "deadline": task.deadline.isoformat() if task.deadline else None, "created_by_id": task.created_by_id}
+
+
+TASK_EVENT_MESSAGES = {
+    "task_created": "Task '{title}' created!",
+    "task_completed": "Task '{title}' completed!",
+    "deadline_renewed": "Task '{title}' deadline renewed to {deadline}!",
+    "task_updated": "Task '{title}' updated!",
+    "task_deleted": "Task '{title}' deleted!",
+}
+
+# The fields whose changes are announced to the team, saves that change none of them are not.
+TASK_EVENT_FIELDS = ("title", "description", "deadline", "task_type", "status")
+
+
+@receiver(pre_save, sender='main.Task')
+def remember_stored_task(sender, instance, update_fields=None, **kwargs):
+    fields = [field for field in TASK_EVENT_FIELDS if update_fields is None or field in update_fields]
+    if instance.team_id and not instance._state.adding and fields:
+        instance._stored_task = sender.objects.filter(pk=instance.pk).values(*fields).first()
+
+
+@receiver(post_save, sender='main.Task')
+def publish_task_change(sender, instance, created, **kwargs):
+    if not instance.team_id:
+        return
+    stored = instance.__dict__.pop("_stored_task", None)
+    if created:
+        event = "task_created"
+    else:
+        changed = {field for field, value in (stored or {}).items() if getattr(instance, field) != value}
+        if not changed:
+            return
+        if changed == {"status"} and instance.status == "COMPLETED":
+            event = "task_completed"
+        elif changed == {"deadline"}:
+            event = "deadline_renewed"
+        else:
+            event = "task_updated"
+    message = TASK_EVENT_MESSAGES[event].format(title=instance.title, deadline=instance.deadline)
+    publish(team_group(instance.team_id), "team", {"event": event, "task": task_payload(instance), "message": message},
+            team_id=instance.team_id)
+
+
+@receiver(post_delete, sender='main.Task')
+def publish_task_deletion(sender, instance, **kwargs):
+    if instance.team_id:
+        message = TASK_EVENT_MESSAGES["task_deleted"].format(title=instance.title)
+        publish(team_group(instance.team_id), "team", {"event": "task_deleted", "task": {"id": instance.id}, "message": message},
+                team_id=instance.team_id)
+
+
+@receiver(post_save, sender='main.Invitation')
+@receiver(post_save, sender='main.LeaderShipInvitation')
+def publish_invitation_status(sender, instance, **kwargs):
+    payload = {"event": "invitation", "invitation": {
+        "id": instance.pk, "kind": instance.class_name, "team_id": instance.team_id,
+        "team": instance.team.name, "status": instance.status,
+        "invited_user_id": instance.invited_user_id, "invited_by_id": instance.invited_by_id,
+    }}
+    for user_id in {instance.invited_user_id, instance.invited_by_id}:
+        publish(invitations_group(user_id), "invitations", payload)
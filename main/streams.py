@@ -0,0 +1,60 @@
+"""
+Channel layer groups behind the streams of the websocket StreamConsumer.
+"notifications" is the same group NotificationConsumer listens to, so existing pushes reach both.
+Both consumers join the team groups of their user on connect, membership changes reach them through the user's group.
+"""
+from .push import push_queue
+
+
+
+def notifications_group(username):
+    return f"notifications_{username}"
+
+
+def team_group(team_id):
+    return f"team_{team_id}"
+
+
+def invitations_group(user_id):
+    return f"invitations_{user_id}"
+
+
+def presence_group(team_id):
+    return f"presence_{team_id}"
+
+
+def user_group(user_id):
+    return f"user_{user_id}"
+
+
+
+def send_on_commit(group_name, event):
+    """
+    This function sends a channel layer event to a group once the surrounding transaction commits,
+    so consumers never see changes that are rolled back.
+    """
+    push_queue.push(group_name, event)
+
+
+def publish(group_name, stream, payload, **keys):
+    """
+    This function sends a stream event to a group on commit.
+    keys (e.g. team_id) identify the stream instance on the client.
+    """
+    send_on_commit(group_name, {"type": "stream_event", "stream": stream, "payload": payload, **keys})
+
+
+def publish_membership(teams, members, joined):
+    """
+    This function publishes that members (id: username) joined or left teams (id: name).
+    Each team gets one event on its group, whatever its size, and the sockets of each member
+    are told to join or leave the team's group.
+    """
+    verb = "joined" if joined else "left"
+    names = ", ".join(members.values())
+    member_list = [{"id": user_id, "username": username} for user_id, username in members.items()]
+    for team_id, team_name in teams.items():
+        publish(team_group(team_id), "team", {"event": f"members_{verb}", "members": member_list,
+                                              "message": f"{names} {verb} the team {team_name}!"}, team_id=team_id)
+        for user_id in members:
+            send_on_commit(user_group(user_id), {"type": "team_membership", "team_id": team_id, "joined": joined})
@@ -0,0 +1,187 @@
+import math
+import time
+
+import numpy as np
+from django.db import connection, transaction
+
+from .models import User, Team, Invitation, LeaderShipInvitation
+from .teammates import invalidate_teammates
+from .streams import publish_membership
+
+
+
+TYPE_INDEX = {user_type: index for index, (user_type, _) in enumerate(User.CHARACTER_TYPES)}
+
+
+class TeamFormationError(Exception):
+    pass
+
+
+
+def solve(types, scores, team_size, improvement_rounds=5000, seed=0):
+    """
+    This function splits users into ceil(n / team_size) teams with a mix of types and evenly spread scores.
+    types holds each user's CHARACTER_TYPES index and scores each user's score.
+    It returns an array with the team number of every user.
+
+    Users are placed greedily from the highest score down, each one into the non-full team where its type
+    is rarest and the score total is lowest (scored for all teams at once), then random swaps between two
+    teams are kept whenever they lower the objective.
+    """
+    types = np.asarray(types, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    n_users = len(types)
+    n_teams = math.ceil(n_users / team_size)
+    n_types = len(TYPE_INDEX)
+
+    assignment = np.empty(n_users, dtype=np.int64)
+    type_counts = np.zeros((n_teams, n_types), dtype=np.int64)
+    score_sums = np.zeros(n_teams)
+    sizes = np.zeros(n_teams, dtype=np.int64)
+
+    score_scale = max(scores.max(initial=0) * team_size, 1.0)
+    for user in np.argsort(-scores, kind="stable"):
+        cost = type_counts[:, types[user]] + score_sums / score_scale + sizes / (team_size * 10)
+        cost[sizes >= team_size] = np.inf
+        team = int(np.argmin(cost))
+        assignment[user] = team
+        type_counts[team, types[user]] += 1
+        score_sums[team] += scores[user]
+        sizes[team] += 1
+
+    if n_teams < 2:
+        return assignment
+
+    # The objective (lower is better) is the number of members sharing their type with a teammate plus
+    # the standard deviation of the teams' mean scores. A swap only touches two teams, so it is evaluated
+    # from their type counts and running sums of the mean scores instead of over every team.
+    def duplicates(team):
+        return int(np.maximum(type_counts[team] - 1, 0).sum())
+
+    means = score_sums / sizes
+    mean_sum, mean_square_sum = means.sum(), (means ** 2).sum()
+
+    def spread(mean_square_sum):
+        return math.sqrt(max(mean_square_sum / n_teams - (mean_sum / n_teams) ** 2, 0.0))
+
+    def move(user, source, target):
+        type_counts[source, types[user]] -= 1
+        type_counts[target, types[user]] += 1
+        score_sums[source] -= scores[user]
+        score_sums[target] += scores[user]
+
+    rng = np.random.default_rng(seed)
+    for first, second in rng.integers(0, n_users, size=(improvement_rounds, 2)):
+        team_a, team_b = assignment[first], assignment[second]
+        if team_a == team_b or (types[first] == types[second] and scores[first] == scores[second]):
+            continue
+
+        before = duplicates(team_a) + duplicates(team_b) + spread(mean_square_sum)
+        old_means = means[team_a], means[team_b]
+        move(first, team_a, team_b)
+        move(second, team_b, team_a)
+        new_means = score_sums[team_a] / sizes[team_a], score_sums[team_b] / sizes[team_b]
+        new_square_sum = (mean_square_sum - old_means[0] ** 2 - old_means[1] ** 2
+                          + new_means[0] ** 2 + new_means[1] ** 2)
+        after = duplicates(team_a) + duplicates(team_b) + spread(new_square_sum)
+
+        if after < before - 1e-12:
+            assignment[first], assignment[second] = team_b, team_a
+            means[team_a], means[team_b] = new_means
+            mean_square_sum = new_square_sum
+        else:
+            move(first, team_b, team_a)
+            move(second, team_a, team_b)
+
+    return assignment
+
+
+
+def balance_metrics(types, scores, assignment, team_size):
+    types = np.asarray(types)
+    scores = np.asarray(scores, dtype=np.float64)
+    n_teams = int(assignment.max()) + 1 if len(assignment) else 0
+    sizes = np.bincount(assignment, minlength=n_teams)
+    distinct_types = np.array([len(np.unique(types[assignment == team])) for team in range(n_teams)])
+    possible_types = np.minimum(sizes, len(TYPE_INDEX))
+    team_means = np.bincount(assignment, weights=scores, minlength=n_teams) / np.maximum(sizes, 1)
+    return {
+        "teams": n_teams,
+        "min_size": int(sizes.min()) if n_teams else 0,
+        "max_size": int(sizes.max(initial=0)),
+        "type_diversity": float((distinct_types / np.maximum(possible_types, 1)).mean()) if n_teams else 0.0,
+        "score_mean_std": float(team_means.std()) if n_teams else 0.0,
+    }
+
+
+
+def _bulk_create_leadership_invitations(invitations):
+    """
+    bulk_create() doesn't support multi-table inheritance, so the parent Invitation rows are bulk created
+    and the LeaderShipInvitation rows that point at them are inserted with a single executemany().
+    """
+    invitations = Invitation.objects.bulk_create(invitations)
+    table = connection.ops.quote_name(LeaderShipInvitation._meta.db_table)
+    column = connection.ops.quote_name(LeaderShipInvitation._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.executemany(f"INSERT INTO {table} ({column}) VALUES (%s)", [(invitation.pk,) for invitation in invitations])
+    return invitations
+
+
+
+def form_teams(users, team_size, name_prefix, invited_by, **solver_options):
+    """
+    This function partitions the given users into teams and creates all the Team rows, memberships and
+    LeaderShipInvitations (one per team, for its best rated LEADER, or best rated member) in one transaction.
+    It returns a report with the solve time and the balance metrics.
+    """
+    users = list(users.only("id", "username", "type", "score"))
+    if not users:
+        raise TeamFormationError("There are no users to form teams from!")
+    if not 1 <= team_size <= 5:
+        raise TeamFormationError("Team size should be between 1 and 5!")
+
+    types = np.array([TYPE_INDEX.get((user.type or "").upper(), 0) for user in users])
+    scores = np.array([float(user.score) if user.score is not None else 0.0 for user in users])
+
+    start = time.perf_counter()
+    assignment = solve(types, scores, team_size, **solver_options)
+    solve_time = time.perf_counter() - start
+
+    n_teams = int(assignment.max()) + 1
+    names = [f"{name_prefix}-{number}" for number in range(1, n_teams + 1)]
+    if max(len(name) for name in names) > Team._meta.get_field("name").max_length:
+        raise TeamFormationError("The team name prefix is too long!")
+    if Team.objects.filter(name__in=names).exists():
+        raise TeamFormationError("Some of the team names are already taken!")
+
+    start = time.perf_counter()
+    with transaction.atomic():
+        teams = Team.objects.bulk_create([Team(name=name, max_members=team_size) for name in names])
+
+        Membership = Team.members.through
+        Membership.objects.bulk_create([Membership(team_id=teams[team].id, user_id=user.id)
+                                        for user, team in zip(users, assignment)])
+        # bulk_create() doesn't send m2m_changed, the new teams only have these users in them.
+        invalidate_teammates([user.id for user in users])
+        members = {}
+        for user, team in zip(users, assignment):
+            members.setdefault(team, {})[user.id] = user.username
+        for team, team_members in members.items():
+            publish_membership({teams[team].id: teams[team].name}, team_members, joined=True)
+
+        leaders = {}
+        for user, team in zip(users, assignment):
+            rank = (user.type.upper() == "LEADER", user.score or 0)
+            if team not in leaders or rank > leaders[team][0]:
+                leaders[team] = (rank, user)
+
+        _bulk_create_leadership_invitations([
+            Invitation(team=teams[team], invited_user=user, invited_by=invited_by)
+            for team, (_, user) in sorted(leaders.items())
+        ])
+    write_time = time.perf_counter() - start
+
+    report = {"users": len(users), "solve_time": solve_time, "write_time": write_time}
+    report.update(balance_metrics(types, scores, assignment, team_size))
+    return teams, report
@@ -0,0 +1,47 @@
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+
+
+TEAMMATES_CACHE_TIMEOUT = 60 * 60
+
+
+
+
+def _cache_key(user_id):
+    return f"teammates:{user_id}"
+
+
+
+def get_teammate_ids(user_id):
+    """
+    This function returns the frozenset of ids of the users sharing at least one team with the user.
+    The set is cached per user and dropped whenever one of the user's teams changes.
+    """
+    teammate_ids = cache.get(_cache_key(user_id))
+    if teammate_ids is None:
+        Membership = apps.get_model("main", "Team").members.through
+        teammate_ids = list(Membership.objects.filter(team__members=user_id).exclude(user_id=user_id)
+                            .values_list("user_id", flat=True).distinct())
+        cache.set(_cache_key(user_id), teammate_ids, timeout=TEAMMATES_CACHE_TIMEOUT)
+    return frozenset(teammate_ids)
+
+
+
+def invalidate_teammates(user_ids):
+    """
+    This function drops the cached teammate sets of the given users. It runs again after the surrounding
+    transaction commits, so a set cached from not yet committed memberships doesn't outlive the change.
+    """
+    keys = [_cache_key(user_id) for user_id in set(user_ids)]
+    if keys:
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+
+def invalidate_team_members(team_ids, extra_user_ids=()):
+    """This function drops the cached teammate sets of every member of the given teams."""
+    Membership = apps.get_model("main", "Team").members.through
+    member_ids = Membership.objects.filter(team_id__in=list(team_ids)).values_list("user_id", flat=True)
+    invalidate_teammates([*member_ids, *extra_user_ids])
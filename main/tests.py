@@ -1,14 +1,70 @@
-from django.test import TestCase, Client
+import asyncio
+import json
+import os
+import tempfile
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from io import StringIO
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection, transaction, OperationalError, IntegrityError
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
 from django.contrib.messages import get_messages
 from django.urls import reverse
+from django.utils import timezone
 from .forms import TeamForm, MySignUpForm
-from .models import Team
+from .models import Team, LeaderShipInvitation, UserRating, TeamRating, Invitation, Notification, Task
+from .notifications import notify, notification_batch
+from .recommendations import user_features
+from .consumers import NotificationConsumer
+from .team_formation import form_teams
+from .push import PushQueue, push_queue
+from .presence import Presence, MemoryPresence, presence
+from .routing import websocket_urlpatterns
+from .leaderboards import leaderboards
+from .learning_model.matchmaker import ModelRegistry, LoadedModel, PredictionCache, normalize_skills, predict_user_type
+from .learning_model.index import CentroidClassifier
+from .learning_model.train import train_centroid
+from .learning_model.artifacts import write_artifact, activate, new_version
+from .learning_model.executor import PredictionExecutor, PredictionUnavailable, prediction_executor
 
 
 User = get_user_model()
 
 
+# The tests get a private cache instead of the shared Redis one, which they would need running and would pollute.
+private_cache = override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                                                      "LOCATION": "tests"}})
+
+
+# Likewise the rankings stay in memory, a rebuild would otherwise overwrite the live Redis ones.
+private_leaderboards = [mock.patch("main.leaderboards.get_redis_client", return_value=None),
+                        mock.patch.object(leaderboards, "_boards", {})]
+
+
+def setUpModule():
+      private_cache.enable()
+      for patcher in private_leaderboards:
+            patcher.start()
+
+
+def tearDownModule():
+      private_cache.disable()
+      for patcher in private_leaderboards:
+            patcher.stop()
+
+
 class TeamFormTests(TestCase):
       def setUp(self):
             self.user = User.objects.create(username="user1", email="user1@gmail.com",
@@ -279,3 +335,1189 @@ class DashboardViewTests(TestCase):
             [error_message] = team_form_obj.errors.as_data()['max_members'][0]
             self.assertEqual(error_message, 'Max members value should be less than five!')
 
+
+
+
+
+class ModelRegistryTests(TestCase):
+      def test_model_is_loaded_on_first_use(self):
+            registry = ModelRegistry()
+            self.assertFalse(registry.is_loaded)
+
+            loaded = registry.get()
+
+            self.assertTrue(registry.is_loaded)
+            self.assertIsNotNone(registry.load_time)
+            self.assertIs(registry.get(), loaded)
+
+
+      def test_predictions_are_cached_on_normalized_skills(self):
+            loaded = ModelRegistry(cache_size=2).get()
+
+            first = loaded.predict(["Python, Django"])
+            second = loaded.predict(["django  PYTHON python"])
+
+            self.assertEqual(first, second)
+            self.assertEqual(normalize_skills("Python, Django"), "django python")
+            self.assertEqual(loaded.cache.stats()["hits"], 1)
+            self.assertEqual(loaded.cache.stats()["misses"], 1)
+
+
+      def test_cache_is_bounded(self):
+            cache = PredictionCache(maxsize=2)
+            for key in ["a", "b", "c"]:
+                  cache.put(key, "doer")
+
+            self.assertIsNone(cache.get("a"))
+            self.assertEqual(cache.stats()["size"], 2)
+
+
+
+class PredictUserTypesAPIViewTests(TestCase):
+      def setUp(self):
+            self.client = Client()
+
+            self.user = User.objects.create(username="user4", email="user4@gmail.com",
+                                             type="leader", skills="Django, Python")
+            self.user.set_password("user4password")
+            self.user.save()
+
+            self.path = "/api/predict_types/"
+
+
+      def test_types_are_returned_in_input_order(self):
+            self.client.login(username="user4", password="user4password")
+            skills = ["Django, Python, Doer, Doing, Do", "Good Leader", "good Thinking"]
+
+            response = self.client.post(self.path, {"skills": skills}, content_type="application/json")
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["types"], [predict_user_type(skill).upper() for skill in skills])
+
+
+      def test_unauthorized_users_are_rejected(self):
+            response = self.client.post(self.path, {"skills": ["Good Leader"]}, content_type="application/json")
+            self.assertEqual(response.status_code, 403)
+
+
+
+class CentroidIndexTests(TestCase):
+      def setUp(self):
+            self.skills = ["python django backend", "python flask backend", "talking people networking", "people events networking"]
+            self.characters = ["doer", "doer", "connector", "connector"]
+
+
+      def test_centroid_model_predicts_through_loaded_model(self):
+            loaded = LoadedModel(train_centroid(self.skills, self.characters), cache_size=8)
+
+            self.assertEqual(loaded.predict(["Django, Python", "networking events"]), ["doer", "connector"])
+
+
+      def test_partial_fit_matches_fit(self):
+            model, vectorizer, encoder = train_centroid(self.skills, self.characters)
+            X = vectorizer.transform(self.skills)
+            y = encoder.transform(self.characters)
+
+            chunked = CentroidClassifier(n_classes=2)
+            chunked.partial_fit(X[:2], y[:2])
+            chunked.partial_fit(X[2:], y[2:])
+
+            self.assertTrue((chunked.centroids_ == model.centroids_).all())
+
+
+
+class ModelArtifactTests(TestCase):
+      def setUp(self):
+            self.directory = tempfile.TemporaryDirectory()
+            self.manifest_path = os.path.join(self.directory.name, "manifest.json")
+            self.addCleanup(self.directory.cleanup)
+
+
+      def activate_new_model(self, version, skills, characters):
+            path = write_artifact(train_centroid(skills, characters), version, directory=self.directory.name)
+            activate(path, version, manifest_path=self.manifest_path)
+            return path
+
+
+      def test_versioned_artifact_is_written_and_activated(self):
+            path = self.activate_new_model("v1", ["python django", "people networking"], ["doer", "connector"])
+            registry = ModelRegistry(manifest_path=self.manifest_path)
+
+            self.assertEqual(os.path.basename(path), "model-v1.pkl")
+            self.assertEqual(registry.get().version, "v1")
+            self.assertEqual(registry.get().predict(["django"]), ["doer"])
+
+
+      def test_versions_made_in_the_same_second_differ(self):
+            versions = [new_version() for _ in range(3)]
+            self.assertEqual(len(set(versions)), 3)
+
+
+      def test_new_version_is_swapped_in_without_restart(self):
+            self.activate_new_model("v1", ["python django", "people networking"], ["doer", "connector"])
+            registry = ModelRegistry(manifest_path=self.manifest_path, reload_interval=0)
+            old_model = registry.get()
+
+            self.activate_new_model("v2", ["python django", "people networking"], ["thinker", "leader"])
+            new_model = registry.get()
+
+            self.assertEqual(new_model.version, "v2")
+            self.assertEqual(new_model.predict(["django"]), ["thinker"])
+            self.assertEqual(old_model.predict(["django"]), ["doer"])
+            self.assertIs(registry.get(), new_model)
+
+
+
+class PredictionExecutorTests(TestCase):
+      def setUp(self):
+            self.form_data = {"username": "user5", "email": "user5@gmail.com", "skills": "Django, Python, Doer, Doing, Do",
+                              "password1": "user5password", "password2": "user5password", "type": "AI-PRED"}
+
+
+      def test_type_is_predicted_off_thread(self):
+            executor = PredictionExecutor(max_workers=1)
+
+            self.assertEqual(asyncio.run(executor.apredict("Django, Python, Doer, Doing, Do")), "doer")
+            self.assertEqual(executor.stats()["completed"], 1)
+            self.assertEqual(executor.stats()["pending"], 0)
+
+
+      def test_a_failed_submission_leaves_the_queue(self):
+            executor = PredictionExecutor(max_workers=1, max_queue=1)
+            with mock.patch.object(executor, "_get_pool") as get_pool:
+                  get_pool.return_value.submit.side_effect = RuntimeError("cannot schedule new futures after shutdown")
+                  with self.assertRaises(PredictionUnavailable):
+                        executor.predict("Django")
+
+            self.assertEqual(executor.stats()["pending"], 0)
+            self.assertEqual(executor.predict("Django, Python, Doer, Doing, Do"), "doer")
+
+
+      def test_saturated_pool_falls_back_to_manual_type_choice(self):
+            with mock.patch.object(prediction_executor, "max_queue", 0):
+                  form = MySignUpForm(data=self.form_data)
+
+                  self.assertFalse(form.is_valid())
+                  self.assertIn("type", form.errors)
+
+            form = MySignUpForm(data=dict(self.form_data, type="DOER"))
+            self.assertTrue(form.is_valid())
+
+
+
+class TeamRecommendationTests(TestCase):
+      def setUp(self):
+            self.client = Client()
+
+            self.leader = User.objects.create(username="leader1", email="leader1@gmail.com", type="LEADER", skills="Python, Django")
+            self.leader.set_password("leader1password")
+            self.leader.save()
+
+            self.thinker = User.objects.create(username="thinker1", email="thinker1@gmail.com", type="THINKER", skills="Research, Design")
+            self.other_leader = User.objects.create(username="leader2", email="leader2@gmail.com", type="LEADER", skills="Python, Django")
+            self.busy_user = User.objects.create(username="busy1", email="busy1@gmail.com", type="DOER", skills="Testing", is_available=False)
+
+            self.team = Team.objects.create(name="team1", leader=self.leader)
+            self.team.members.add(self.leader)
+
+            user_features.build()
+            self.path = f"/api/teams/{self.team.id}/recommend/"
+
+
+      def test_complementary_users_are_ranked_first(self):
+            self.client.login(username="leader1", password="leader1password")
+            response = self.client.get(self.path)
+
+            usernames = [user["username"] for user in response.json()["recommendations"]]
+            self.assertEqual(usernames, ["thinker1", "leader2"])
+
+
+      def test_matrix_is_updated_when_users_change(self):
+            self.thinker.is_available = False
+            self.thinker.save()
+
+            ranking = user_features.recommend([self.leader.id])
+            self.assertEqual([user_id for user_id, _ in ranking], [self.other_leader.id])
+
+
+
+class TrainMatchmakerCommandTests(TestCase):
+      def test_an_empty_user_table_is_reported(self):
+            for index in ("knn", "centroid"):
+                  stdout, stderr = StringIO(), StringIO()
+                  with mock.patch("main.management.commands.train_matchmaker.write_artifact") as write:
+                        call_command("train_matchmaker", "--index", index, stdout=stdout, stderr=stderr)
+                  self.assertIn("There are no users to train on!", stderr.getvalue())
+                  write.assert_not_called()
+
+
+      def test_the_report_is_written_to_the_command_output(self):
+            for number, user_type in enumerate(["DOER", "LEADER", "DOER", "LEADER"]):
+                  User.objects.create(username=f"trainee{number}", email=f"trainee{number}@gmail.com", type=user_type, skills="Python, Django")
+            report = {"knn": {"accuracy": 0.5, "latency_ms": 1.0, "artifact_kb": 2.0}}
+            stdout = StringIO()
+            with mock.patch("main.management.commands.train_matchmaker.write_artifact"), \
+                 mock.patch("main.management.commands.train_matchmaker.activate"), \
+                 mock.patch("main.learning_model.benchmark.compare_indexes", return_value=report):
+                  call_command("train_matchmaker", "--report", stdout=stdout)
+            lines = stdout.getvalue().splitlines()
+            self.assertEqual(lines[-3].split(), ["index", "accuracy", "latency_ms", "artifact_kb"])
+            self.assertEqual(lines[-2].split(), ["knn", "0.500", "1.000", "2.0"])
+
+
+
+class FormTeamsCommandTests(TestCase):
+      def setUp(self):
+            self.organizer = User.objects.create(username="organizer", email="organizer@gmail.com", type="LEADER", skills="Events")
+            types = ["LEADER", "SUPPORTER", "THINKER", "DOER", "CONNECTOR"]
+            for number in range(12):
+                  User.objects.create(username=f"hacker{number}", email=f"hacker{number}@gmail.com",
+                                      type=types[number % 5], skills="Python", score=number % 5 + 1)
+
+
+      def test_teams_memberships_and_invitations_are_created(self):
+            call_command("form_teams", "hack", "--invited-by", "organizer", "--filter", "username__startswith=hacker", stdout=StringIO())
+
+            teams = Team.objects.filter(name__startswith="hack-")
+            self.assertEqual(teams.count(), 3)
+            self.assertEqual(sum(team.members.count() for team in teams), 12)
+            self.assertTrue(all(team.members.count() <= 5 for team in teams))
+            self.assertTrue(all(len({member.type for member in team.members.all()}) >= 4 for team in teams))
+
+            invitations = LeaderShipInvitation.objects.filter(team__in=teams, invited_by=self.organizer)
+            self.assertEqual(invitations.count(), 3)
+            self.assertTrue(all(invitation.invited_user in invitation.team.members.all() for invitation in invitations))
+
+
+      def test_the_query_count_does_not_grow_with_the_users(self):
+            users = User.objects.filter(username__startswith="hacker")
+            with CaptureQueriesContext(connection) as queries:
+                  form_teams(users, 5, "few", self.organizer)
+            for number in range(12, 40):
+                  User.objects.create(username=f"hacker{number}", email=f"hacker{number}@gmail.com", type="DOER", skills="Python")
+            with self.assertNumQueries(len(queries)):
+                  form_teams(users, 5, "many", self.organizer)
+
+
+
+class UserSearchTests(TestCase):
+      def setUp(self):
+            self.client = Client()
+
+            self.user = User.objects.create(username="searcher", email="searcher@gmail.com", type="LEADER", skills="Python")
+            self.user.set_password("searcherpassword")
+            self.user.save()
+
+            for username in ["annabel", "joanna", "anna", "hannah", "bob"]:
+                  User.objects.create(username=username, email=f"{username}@gmail.com", type="DOER", skills="Python")
+
+
+      def test_prefix_matches_are_ranked_first_and_limited(self):
+            self.client.login(username="searcher", password="searcherpassword")
+            response = self.client.get("/api/users/search/", {"q": "ANN", "limit": 3})
+
+            usernames = [user["username"] for user in response.json()["results"]]
+            self.assertEqual(usernames, ["anna", "annabel", "hannah"])
+
+
+      def test_username_search_index_exists(self):
+            with connection.cursor() as cursor:
+                  indexes = connection.introspection.get_constraints(cursor, User._meta.db_table)
+            self.assertTrue(any(name.startswith("main_user_username_") for name in indexes))
+
+
+
+class BulkRatingAPIViewTests(TestCase):
+      def setUp(self):
+            self.client = Client()
+
+            self.rater = User.objects.create(username="rater1", email="rater1@gmail.com", type="DOER", skills="Python")
+            self.rater.set_password("rater1password")
+            self.rater.save()
+
+            self.teammates = [User.objects.create(username=f"mate{number}", email=f"mate{number}@gmail.com", type="DOER", skills="Python")
+                              for number in range(3)]
+            self.stranger = User.objects.create(username="stranger1", email="stranger1@gmail.com", type="DOER", skills="Python")
+
+            self.team = Team.objects.create(name="rated_team1")
+            self.team.members.add(self.rater, *self.teammates)
+            self.other_team = Team.objects.create(name="rated_team2")
+            self.other_team.members.add(self.stranger)
+
+            UserRating.objects.create(rater=self.rater, rated=self.teammates[0], rating=5)
+            self.teammates[0].calculate_new_score(5)
+
+            self.path = "/api/ratings/"
+            self.client.login(username="rater1", password="rater1password")
+
+
+      def test_ratings_are_saved_in_one_call(self):
+            payload = {"users": [{"user_id": user.id, "rating": rating} for user, rating in zip(self.teammates, [1, 4, 2])],
+                       "teams": [{"team_id": self.team.id, "rating": 3}]}
+
+            response = self.client.post(self.path, payload, content_type="application/json")
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()["rated_users"], [self.teammates[1].id, self.teammates[2].id])
+            self.assertEqual(response.json()["skipped_users"], [self.teammates[0].id])
+            self.assertEqual(UserRating.objects.filter(rater=self.rater).count(), 3)
+
+            scores = [User.objects.get(pk=user.pk).score for user in self.teammates]
+            self.assertEqual(scores, [Decimal("5.0"), Decimal("4.0"), Decimal("2.0")])
+            self.team.refresh_from_db()
+            self.assertEqual((self.team.teamwork_score, self.team.score_count), (Decimal("3.0"), 1))
+
+
+      def test_nothing_is_saved_if_any_rated_user_is_not_a_teammate(self):
+            payload = {"users": [{"user_id": self.teammates[1].id, "rating": 4}, {"user_id": self.stranger.id, "rating": 1}],
+                       "teams": [{"team_id": self.other_team.id, "rating": 1}]}
+
+            response = self.client.post(self.path, payload, content_type="application/json")
+
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.json()["users"], [self.stranger.id])
+            self.assertEqual(response.json()["teams"], [self.other_team.id])
+            self.assertFalse(UserRating.objects.filter(rated=self.teammates[1]).exists())
+
+
+      def test_ratings_through_the_user_endpoint_are_recorded_once(self):
+            path = f"/api/users/{self.teammates[1].id}/"
+            response = self.client.patch(path, {"score": 4}, content_type="application/json")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(UserRating.objects.get(rater=self.rater, rated=self.teammates[1]).rating, 4)
+
+            response = self.client.patch(path, {"score": 1}, content_type="application/json")
+            self.assertEqual(response.status_code, 400)
+            rated = User.objects.get(pk=self.teammates[1].pk)
+            self.assertEqual((rated.score, rated.score_sum, rated.score_count), (Decimal("4.0"), 4, 1))
+
+
+class TeammateIndexTests(TestCase):
+      def setUp(self):
+            # A private cache keeps the invalidation checks independent of what other tests cached.
+            patcher = mock.patch("main.teammates.cache", LocMemCache("teammates", {}))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+            self.client = Client()
+            self.user = User.objects.create(username="mate_a", email="mate_a@gmail.com", type="DOER", skills="Python")
+            self.user.set_password("mate_apassword")
+            self.user.save()
+            self.other = User.objects.create(username="mate_b", email="mate_b@gmail.com", type="DOER", skills="Python")
+            self.newcomer = User.objects.create(username="mate_c", email="mate_c@gmail.com", type="DOER", skills="Python")
+
+            self.team = Team.objects.create(name="mates_team")
+            self.team.members.add(self.user, self.other)
+
+
+      def test_teammate_check_is_served_from_the_cache(self):
+            self.assertTrue(User.objects.are_teammates(self.user, self.other))
+            with self.assertNumQueries(0):
+                  self.assertTrue(User.objects.are_teammates(self.user, self.other))
+                  self.assertFalse(User.objects.are_teammates(self.user, self.newcomer))
+
+
+      def test_cache_is_invalidated_on_membership_changes(self):
+            self.assertEqual(User.objects.teammate_ids(self.user), {self.other.id})
+
+            self.newcomer.teams.add(self.team)
+            self.assertEqual(User.objects.teammate_ids(self.user), {self.other.id, self.newcomer.id})
+
+            self.team.remove_member(self.other)
+            self.assertEqual(User.objects.teammate_ids(self.user), {self.newcomer.id})
+            self.assertEqual(User.objects.teammate_ids(self.other), set())
+
+            self.team.delete()
+            self.assertEqual(User.objects.teammate_ids(self.newcomer), set())
+
+
+      def test_teammates_are_listed(self):
+            self.client.login(username="mate_a", password="mate_apassword")
+            response = self.client.get("/api/users/teammates/")
+
+            self.assertEqual([user["username"] for user in response.json()["teammates"]], ["mate_b"])
+
+
+class LeaderboardTests(TestCase):
+      def setUp(self):
+            self.client = Client()
+
+            self.user = User.objects.create(username="ranked0", email="ranked0@gmail.com", type="DOER", skills="Python")
+            self.user.set_password("ranked0password")
+            self.user.save()
+            self.users = [self.user] + [User.objects.create(username=f"ranked{number}", email=f"ranked{number}@gmail.com",
+                                                            type="LEADER" if number % 2 else "DOER", skills="Python")
+                                        for number in range(1, 5)]
+            User.objects.create(username="unrated", email="unrated@gmail.com", type="DOER", skills="Python")
+
+            self.team = Team.objects.create(name="ranked_team1")
+            self.team.members.add(*self.users[:3])
+            self.other_team = Team.objects.create(name="ranked_team2")
+
+            leaderboards.rebuild()
+            for user, rating in zip(self.users, [3, 5, 1, 4, 2]):
+                  user.calculate_new_score(rating)
+            self.team.recalculate_teamwork_score(2)
+            self.other_team.recalculate_teamwork_score(4)
+
+            self.client.login(username="ranked0", password="ranked0password")
+
+
+      def test_top_users_and_my_rank(self):
+            response = self.client.get("/api/leaderboards/users/", {"limit": 2})
+
+            self.assertEqual([user["username"] for user in response.json()["results"]], ["ranked1", "ranked3"])
+            self.assertEqual(response.json()["me"], {"rank": 3, "score": 3.0})
+            self.assertEqual(response.json()["total"], 5)
+
+            response = self.client.get("/api/leaderboards/users/", {"type": "doer"})
+            self.assertEqual([user["username"] for user in response.json()["results"]], ["ranked0", "ranked4", "ranked2"])
+
+
+      def test_rankings_match_a_rebuild_from_the_database(self):
+            self.users[2].calculate_new_score(5)
+            self.users[1].type = "DOER"
+            self.users[1].save()
+            incremental = [leaderboards.users(user_type).top(10) for user_type in [None, "DOER", "LEADER"]]
+
+            leaderboards.rebuild()
+
+            self.assertEqual([leaderboards.users(user_type).top(10) for user_type in [None, "DOER", "LEADER"]], incremental)
+            self.assertEqual(leaderboards.users("LEADER").top(10), [(self.users[3].id, 4.0)])
+
+
+      def test_saving_a_stale_user_keeps_the_stored_score(self):
+            stale = User.objects.get(pk=self.user.pk)
+            self.user.calculate_new_score(5)
+
+            stale.type = "LEADER"
+            stale.save()
+
+            self.assertEqual(leaderboards.users().rank(self.user.id), (1, 4.0))
+            self.assertEqual(leaderboards.users("LEADER").rank(self.user.id), (1, 4.0))
+            self.assertIsNone(leaderboards.users("DOER").rank(self.user.id))
+
+
+      def test_team_leaderboards(self):
+            response = self.client.get("/api/leaderboards/teams/")
+            self.assertEqual([team["name"] for team in response.json()["results"]], ["ranked_team2", "ranked_team1"])
+            self.assertEqual(response.json()["mine"], [{"rank": 2, "id": self.team.id, "name": "ranked_team1", "score": 2.0}])
+
+            response = self.client.get(f"/api/teams/{self.team.id}/leaderboard/")
+            self.assertEqual([member["username"] for member in response.json()["results"]], ["ranked1", "ranked0", "ranked2"])
+
+
+class RecomputeScoresCommandTests(TestCase):
+      def setUp(self):
+            self.users = [User.objects.create(username=f"scored{number}", email=f"scored{number}@gmail.com", type="DOER", skills="Python")
+                          for number in range(4)]
+            self.team = Team.objects.create(name="scored_team")
+
+            for rater, rating in zip(self.users[1:], [4, 5, 5]):
+                  UserRating.objects.create(rater=rater, rated=self.users[0], rating=rating)
+                  TeamRating.objects.create(user=rater, team=self.team, rating=rating - 2)
+
+            # Drifted aggregates: a lost update, a float-rounded average and a user with no ratings at all.
+            User.objects.filter(pk=self.users[0].pk).update(score=Decimal("4.4"), score_sum=9, score_count=2)
+            User.objects.filter(pk=self.users[1].pk).update(score=Decimal("3.0"), score_sum=3, score_count=1)
+            Team.objects.filter(pk=self.team.pk).update(teamwork_score=Decimal("2.6"), score_sum=8, score_count=3)
+
+
+      def test_dry_run_only_reports_the_drift(self):
+            out = StringIO()
+            call_command("recompute_scores", "--dry-run", stdout=out)
+
+            self.assertIn("users: checked 4, drifted 2, fixed 0", out.getvalue())
+            self.assertIn("teams: checked 1, drifted 1, fixed 0", out.getvalue())
+            self.assertEqual(User.objects.get(pk=self.users[0].pk).score_count, 2)
+
+
+      def test_aggregates_are_rebuilt_from_the_ratings(self):
+            call_command("recompute_scores", "--chunk-size", "1", stdout=StringIO())
+
+            scores = list(User.objects.filter(pk__in=[user.pk for user in self.users]).order_by("pk")
+                          .values_list("score", "score_sum", "score_count"))
+            self.assertEqual(scores, [(Decimal("4.7"), 14, 3), (None, 0, 0), (None, 0, 0), (None, 0, 0)])
+            self.team.refresh_from_db()
+            self.assertEqual((self.team.teamwork_score, self.team.score_sum, self.team.score_count), (Decimal("2.7"), 8, 3))
+
+            out = StringIO()
+            call_command("recompute_scores", stdout=out)
+            self.assertIn("users: checked 4, drifted 0", out.getvalue())
+
+
+class RatingAggregateTests(TestCase):
+      def setUp(self):
+            self.user = User.objects.create(username="averaged", email="averaged@gmail.com", type="DOER", skills="Python")
+            self.team = Team.objects.create(name="averaged_team")
+
+
+      def test_averages_keep_their_fraction(self):
+            self.assertEqual([self.user.calculate_new_score(rating) for rating in (5, 4, 4)], [Decimal("5.0"), Decimal("4.5"), Decimal("4.3")])
+            self.assertEqual([self.team.recalculate_teamwork_score(rating) for rating in (2, 3, 3, 3)],
+                             [Decimal("2.0"), Decimal("2.5"), Decimal("2.7"), Decimal("2.8")])
+
+
+      def test_rows_rated_before_the_running_sum_keep_their_average(self):
+            User.objects.filter(pk=self.user.pk).update(score=Decimal("4.0"), score_sum=0, score_count=3)
+            self.assertEqual(self.user.calculate_new_score(5), Decimal("4.3"))
+            self.assertEqual((self.user.score_sum, self.user.score_count), (17, 4))
+
+
+      def test_saving_a_stale_instance_keeps_the_aggregates(self):
+            stale_team = Team.objects.get(pk=self.team.pk)
+            stale_user = User.objects.get(pk=self.user.pk)
+            self.team.recalculate_teamwork_score(5)
+            self.user.calculate_new_score(4)
+
+            stale_team.add_member(self.user)
+            stale_team.name = "renamed_team"
+            stale_team.save()
+            stale_user.change_availability()
+            stale_user.bio = "Saved from a stale instance"
+            stale_user.save()
+
+            team, user = Team.objects.get(pk=self.team.pk), User.objects.get(pk=self.user.pk)
+            self.assertEqual((team.name, team.teamwork_score, team.score_count), ("renamed_team", Decimal("5.0"), 1))
+            self.assertEqual((user.bio, user.score, user.score_count), ("Saved from a stale instance", Decimal("4.0"), 1))
+
+
+
+class ConcurrentRatingTests(TransactionTestCase):
+      RATINGS = 200
+
+      def setUp(self):
+            self.rated_user = User.objects.create(username="rated", email="rated@gmail.com", type="DOER", skills="Python")
+            self.team = Team.objects.create(name="rated_team")
+            User.objects.bulk_create([User(username=f"rater{number}", email=f"rater{number}@gmail.com", type="DOER", skills="Python")
+                                      for number in range(self.RATINGS)])
+            self.rater_ids = list(User.objects.filter(username__startswith="rater").values_list("id", flat=True))
+            self.ratings = [number % 5 + 1 for number in range(self.RATINGS)]
+
+
+      def submit_in_parallel(self, rate):
+            def task(args):
+                  try:
+                        for attempt in range(500):
+                              try:
+                                    with transaction.atomic():
+                                          rate(*args)
+                                    return
+                              except OperationalError:
+                                    # SQLite reports a locked table instead of waiting for the lock, the whole transaction is retried.
+                                    time.sleep(random.uniform(0, 0.01))
+                        raise AssertionError("The rating could not be saved")
+                  finally:
+                        connection.close()
+
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                  list(executor.map(task, zip(self.rater_ids, self.ratings)))
+
+
+      def test_no_user_rating_is_lost(self):
+            def rate(rater_id, rating):
+                  UserRating.objects.create(rater_id=rater_id, rated=self.rated_user, rating=rating)
+                  User.objects.get(pk=self.rated_user.pk).calculate_new_score(rating)
+
+            self.submit_in_parallel(rate)
+
+            self.rated_user.refresh_from_db()
+            self.assertEqual(self.rated_user.score_count, self.RATINGS)
+            self.assertEqual(self.rated_user.score_sum, sum(self.ratings))
+            self.assertEqual(self.rated_user.score, round(Decimal(sum(self.ratings)) / self.RATINGS, 1))
+
+
+      def test_no_team_rating_is_lost(self):
+            def rate(rater_id, rating):
+                  TeamRating.objects.create(user_id=rater_id, team=self.team, rating=rating)
+                  Team.objects.get(pk=self.team.pk).recalculate_teamwork_score(rating)
+
+            self.submit_in_parallel(rate)
+
+            self.team.refresh_from_db()
+            self.assertEqual(self.team.score_count, self.RATINGS)
+            self.assertEqual(self.team.score_sum, sum(self.ratings))
+            self.assertEqual(self.team.teamwork_score, round(Decimal(sum(self.ratings)) / self.RATINGS, 1))
+
+
+
+
+class NotificationBatchTests(TestCase):
+      def setUp(self):
+            self.leader = User.objects.create(username="batch_leader", email="batch_leader@gmail.com", type="LEADER", skills="Python")
+            self.user = User.objects.create(username="batch_user", email="batch_user@gmail.com", type="DOER", skills="Python")
+            self.team = Team.objects.create(name="batch_team", leader=self.leader)
+
+
+      def test_notifications_are_written_once_after_commit(self):
+            invitation = Invitation.objects.create(team=self.team, invited_user=self.user, invited_by=self.leader)
+
+            with mock.patch("main.notifications.push_notification") as push:
+                  with self.captureOnCommitCallbacks() as callbacks:
+                        with transaction.atomic():
+                              invitation.accept()
+                              notify(self.leader, "Task created!", push=True)
+                        self.assertFalse(Notification.objects.filter(user=self.leader).exists())
+                        self.assertFalse(push.called)
+
+                  with CaptureQueriesContext(connection) as queries:
+                        for callback in callbacks:
+                              callback()
+                  self.assertEqual(len([query for query in queries if query["sql"].startswith("INSERT")]), 1)
+
+                  notification = Notification.objects.get(user=self.leader, message="Task created!")
+                  push.assert_called_once_with("batch_leader", "Task created!", notification.id, notification.created_at)
+            self.assertEqual(Notification.objects.filter(user=self.leader).count(), 2)
+
+
+      def test_rolled_back_notifications_are_dropped(self):
+            with self.captureOnCommitCallbacks(execute=True):
+                  with transaction.atomic():
+                        notify(self.user, "kept")
+                        try:
+                              with transaction.atomic():
+                                    notify(self.user, "lost")
+                                    raise IntegrityError
+                        except IntegrityError:
+                              pass
+
+            self.assertEqual(list(Notification.objects.filter(user=self.user).values_list("message", flat=True)), ["kept"])
+
+
+
+class NotificationActionsTests(TestCase):
+      def setUp(self):
+            self.client = Client()
+            self.user = User.objects.create(username="reader", email="reader@gmail.com", type="DOER", skills="Python")
+            self.user.set_password("readerpassword")
+            self.user.save()
+            self.other = User.objects.create(username="other_reader", email="other_reader@gmail.com", type="DOER", skills="Python")
+            Notification.objects.bulk_create([Notification(user=self.other, message="not yours")])
+            self.client.login(username="reader", password="readerpassword")
+
+
+      def create_notifications(self, count):
+            Notification.objects.bulk_create([Notification(user=self.user, message=f"message {number}") for number in range(count)])
+
+
+      def test_mark_all_as_read_uses_a_constant_number_of_queries(self):
+            queries = []
+            for count in [10, 500]:
+                  Notification.objects.filter(user=self.user).delete()
+                  self.create_notifications(count)
+                  with CaptureQueriesContext(connection) as captured:
+                        response = self.client.post("/api/notifications/mark_all_as_read/")
+                  self.assertEqual(response.json()["updated"], count)
+                  queries.append(len(captured))
+
+            self.assertEqual(queries[0], queries[1])
+            self.assertFalse(Notification.objects.filter(user=self.user, is_read=False).exists())
+            self.assertTrue(Notification.objects.filter(user=self.other, is_read=False).exists())
+
+
+      def test_selected_notifications_are_marked_as_read(self):
+            self.create_notifications(3)
+            ids = list(Notification.objects.filter(user=self.user).values_list("id", flat=True)[:2])
+            foreign_id = Notification.objects.get(user=self.other).id
+
+            response = self.client.post("/api/notifications/mark_as_read/", {"ids": ids + [foreign_id]}, content_type="application/json")
+
+            self.assertEqual(response.json()["updated"], 2)
+            self.assertEqual(Notification.objects.filter(user=self.user, is_read=False).count(), 1)
+            self.assertFalse(Notification.objects.get(id=foreign_id).is_read)
+
+
+      def test_old_read_notifications_are_deleted(self):
+            self.create_notifications(4)
+            notifications = Notification.objects.filter(user=self.user)
+            old_ids = list(notifications.values_list("id", flat=True)[:3])
+            Notification.objects.filter(id__in=old_ids).update(created_at=timezone.now() - timedelta(days=40))
+            Notification.objects.filter(id__in=old_ids[:2]).update(is_read=True)
+
+            with self.assertNumQueries(3):
+                  response = self.client.post("/api/notifications/delete_read/", {"older_than_days": 30}, content_type="application/json")
+
+            self.assertEqual(response.json()["deleted"], 2)
+            self.assertEqual(notifications.count(), 2)
+
+
+class UnreadCounterTests(TestCase):
+      def setUp(self):
+            self.client = Client()
+            self.user = User.objects.create(username="counted", email="counted@gmail.com", type="DOER", skills="Python")
+            self.user.set_password("countedpassword")
+            self.user.save()
+
+            patcher = mock.patch("main.notifications.push_unread_count")
+            self.push = patcher.start()
+            self.addCleanup(patcher.stop)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                  with transaction.atomic():
+                        for number in range(4):
+                              notify(self.user, f"message {number}")
+            self.client.login(username="counted", password="countedpassword")
+
+
+      def unread_count(self):
+            return self.client.get("/api/notifications/unread_count/").json()["unread_count"]
+
+
+      def test_counter_follows_creates_reads_and_deletes(self):
+            self.assertEqual(self.unread_count(), 4)
+            self.push.assert_called_with("counted", 4)
+
+            ids = list(Notification.objects.filter(user=self.user).values_list("id", flat=True))
+            with self.captureOnCommitCallbacks(execute=True):
+                  self.client.post("/api/notifications/mark_as_read/", {"ids": ids[:2]}, content_type="application/json")
+            self.assertEqual(self.unread_count(), 2)
+            self.push.assert_called_with("counted", 2)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                  self.client.delete(f"/api/notifications/{ids[2]}/")
+            self.assertEqual(self.unread_count(), 1)
+
+            Notification.objects.get(id=ids[3]).mark_as_read()
+            self.assertEqual(self.unread_count(), 0)
+
+
+      def test_drifted_counter_is_recounted(self):
+            User.objects.filter(pk=self.user.pk).update(unread_notifications=40)
+            self.client.post("/api/notifications/mark_all_as_read/")
+            self.assertEqual(self.unread_count(), 0)
+
+
+class NotificationPaginationTests(TestCase):
+      def setUp(self):
+            self.client = Client()
+            self.user = User.objects.create(username="paged", email="paged@gmail.com", type="DOER", skills="Python")
+            self.user.set_password("pagedpassword")
+            self.user.save()
+
+            # Several notifications share a created_at, so (created_at, id) has to break the ties.
+            now = timezone.now()
+            Notification.objects.bulk_create([Notification(user=self.user, message=f"message {number}") for number in range(25)])
+            for number, notification in enumerate(Notification.objects.filter(user=self.user).order_by("id")):
+                  Notification.objects.filter(pk=notification.pk).update(created_at=now - timedelta(minutes=25 - number // 3))
+            self.newest_first = list(Notification.objects.filter(user=self.user).order_by("-created_at", "-id").values_list("id", flat=True))
+            self.client.login(username="paged", password="pagedpassword")
+
+
+      def test_api_pages_are_stable_under_new_notifications(self):
+            response = self.client.get("/api/notifications/")
+            ids = [notification["id"] for notification in response.json()["results"]]
+
+            Notification.objects.create(user=self.user, message="new one")
+            next_url = response.json()["next"]
+            while next_url:
+                  with CaptureQueriesContext(connection) as queries:
+                        response = self.client.get(next_url)
+                  self.assertFalse(any("COUNT(" in query["sql"] for query in queries))
+                  ids += [notification["id"] for notification in response.json()["results"]]
+                  next_url = response.json()["next"]
+
+            self.assertEqual(ids, self.newest_first)
+
+
+      def test_notifications_view_walks_pages_by_cursor(self):
+            path = reverse("notifications", kwargs={"pk": self.user.pk})
+            pages, cursors = [], []
+            response = self.client.get(path)
+            while True:
+                  pages.append([notification.id for notification in response.context["notifications"]])
+                  if not response.context["next_cursor"]:
+                        break
+                  cursors.append(response.context["next_cursor"])
+                  with CaptureQueriesContext(connection) as queries:
+                        response = self.client.get(path, {"after": cursors[-1]})
+                  self.assertFalse(any("COUNT(" in query["sql"] or "OFFSET" in query["sql"] for query in queries))
+
+            self.assertEqual([len(page) for page in pages], [10, 10, 5])
+            self.assertEqual(sum(pages, []), self.newest_first)
+
+            response = self.client.get(path, {"before": response.context["previous_cursor"]})
+            self.assertEqual([notification.id for notification in response.context["notifications"]], pages[1])
+
+
+class PruneNotificationsCommandTests(TestCase):
+      def setUp(self):
+            self.user = User.objects.create(username="pruned", email="pruned@gmail.com", type="DOER", skills="Python")
+            Notification.objects.bulk_create([Notification(user=self.user, message=f"message {number}", is_read=number % 3 != 0)
+                                              for number in range(30)])
+            notifications = Notification.objects.filter(user=self.user).order_by("id")
+            old_ids = list(notifications.values_list("id", flat=True)[:24])
+            Notification.objects.filter(id__in=old_ids).update(created_at=timezone.now() - timedelta(days=100))
+            self.expected = set(Notification.objects.read_older_than(90).values_list("id", flat=True))
+
+
+      def test_dry_run_changes_nothing(self):
+            out = StringIO()
+            call_command("prune_notifications", "--dry-run", stdout=out)
+            self.assertIn(f"{len(self.expected)} read notifications older than 90 days would be pruned", out.getvalue())
+            self.assertEqual(Notification.objects.count(), 30)
+
+
+      def test_old_read_notifications_are_archived_and_deleted_in_batches(self):
+            with tempfile.TemporaryDirectory() as directory:
+                  path = os.path.join(directory, "notifications.jsonl")
+                  out = StringIO()
+                  call_command("prune_notifications", "--batch-size", "5", "--archive", path, stdout=out)
+
+                  with open(path) as archive:
+                        archived = {json.loads(line)["id"] for line in archive}
+
+            self.assertEqual(archived, self.expected)
+            self.assertFalse(Notification.objects.filter(id__in=self.expected).exists())
+            self.assertEqual(Notification.objects.count(), 30 - len(self.expected))
+            self.assertEqual(out.getvalue().count("Pruned"), 4)
+
+
+class AutocommitNotificationTests(TransactionTestCase):
+      def test_request_notifications_are_written_together(self):
+            user = User.objects.create(username="request_user", email="request_user@gmail.com", type="DOER", skills="Python")
+            with CaptureQueriesContext(connection) as queries:
+                  with notification_batch():
+                        for number in range(3):
+                              notify(user, f"message {number}")
+            self.assertEqual(len([query for query in queries if query["sql"].startswith("INSERT")]), 1)
+            self.assertEqual(Notification.objects.filter(user=user).count(), 3)
+
+
+      def test_batch_of_a_rolled_back_transaction_is_not_reused(self):
+            user = User.objects.create(username="rollback_user", email="rollback_user@gmail.com", type="DOER", skills="Python")
+            try:
+                  with transaction.atomic():
+                        notify(user, "lost")
+                        raise IntegrityError
+            except IntegrityError:
+                  pass
+
+            with transaction.atomic():
+                  notify(user, "kept")
+
+            self.assertEqual(list(Notification.objects.filter(user=user).values_list("message", flat=True)), ["kept"])
+
+
+
+
+class NotificationReplayTests(TransactionTestCase):
+      def setUp(self):
+            self.user = User.objects.create(username="replayed", email="replayed@gmail.com", type="DOER", skills="Python")
+            Notification.objects.bulk_create([Notification(user=self.user, message=f"message {number}") for number in range(7)])
+            self.ids = list(Notification.objects.filter(user=self.user).order_by("id").values_list("id", flat=True))
+            # Pushes are sent right away, so the sockets have them before the assertions.
+            self.enterContext(mock.patch.object(push_queue, "window", 0))
+
+
+      async def connect(self, path, query_string, user):
+            scope = {"type": "websocket", "path": path, "query_string": query_string.encode(), "headers": [], "user": user}
+            communicator = ApplicationCommunicator(URLRouter(websocket_urlpatterns), scope)
+            await communicator.send_input({"type": "websocket.connect"})
+            return communicator, (await communicator.receive_output())["type"] == "websocket.accept"
+
+
+      async def receive_json(self, communicator, timeout=1):
+            return json.loads((await communicator.receive_output(timeout))["text"])
+
+
+      async def test_missed_notifications_are_replayed_in_chunks_before_live_ones(self):
+            with mock.patch.object(NotificationConsumer, "REPLAY_CHUNK_SIZE", 2):
+                  communicator, connected = await self.connect("/ws/notifications/replayed/", f"last_seen={self.ids[2]}", self.user)
+                  self.assertTrue(connected)
+
+                  replayed = [await self.receive_json(communicator) for _ in range(4)]
+                  self.assertEqual([message["id"] for message in replayed], self.ids[3:])
+                  self.assertEqual(await self.receive_json(communicator),
+                                   {"replay_complete": True, "last_seen": self.ids[-1], "truncated": False})
+
+                  # A replayed notification pushed again is skipped, a new one goes through.
+                  channel_layer = get_channel_layer()
+                  await channel_layer.group_send("notifications_replayed", {"type": "send_notification", "message": "again", "id": self.ids[-1]})
+                  await channel_layer.group_send("notifications_replayed", {"type": "send_notification", "message": "live", "id": self.ids[-1] + 1})
+                  self.assertEqual((await self.receive_json(communicator))["message"], "live")
+                  self.assertTrue(await communicator.receive_nothing())
+                  await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+                  await communicator.wait()
+
+
+      async def test_batched_pushes_are_sent_as_one_frame(self):
+            communicator, connected = await self.connect("/ws/notifications/replayed/", "", self.user)
+            self.assertTrue(connected)
+            await get_channel_layer().group_send("notifications_replayed", {"type": "push_batch", "events": [
+                  {"type": "send_notification", "message": "batched", "id": self.ids[-1] + 1},
+                  {"type": "send_unread_count", "count": 8},
+            ]})
+            self.assertEqual(await self.receive_json(communicator),
+                             {"batch": [{"id": self.ids[-1] + 1, "message": "batched", "created_at": None}, {"unread_count": 8}]})
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+            await communicator.wait()
+
+
+      async def test_teammates_see_each_other_come_online_and_leave(self):
+            team = await sync_to_async(Team.objects.create)(name="present_team")
+            mate = await sync_to_async(User.objects.create)(username="present_mate", email="present_mate@gmail.com", type="DOER", skills="Python")
+            await sync_to_async(team.members.add)(self.user, mate)
+
+            with mock.patch.object(presence, "_store", MemoryPresence()), mock.patch.object(presence, "interval", 0.2):
+                  watcher, _ = await self.connect("/ws/stream/", "", self.user)
+                  await self.receive_json(watcher)
+                  await watcher.send_input({"type": "websocket.receive", "text": json.dumps({"action": "subscribe", "stream": "presence", "team_id": team.id})})
+                  self.assertEqual((await self.receive_json(watcher))["type"], "subscribed")
+
+                  # The watcher and both of the mate's sockets coming online within the interval make one update.
+                  sockets = [(await self.connect("/ws/notifications/present_mate/", "", mate))[0] for _ in range(2)]
+                  event = await self.receive_json(watcher)
+                  self.assertEqual((event["stream"], event["team_id"], event["payload"]),
+                                   ("presence", team.id, {"online": sorted([self.user.id, mate.id]), "offline": []}))
+                  await sockets[0].send_input({"type": "websocket.receive", "text": json.dumps({"type": "heartbeat"})})
+                  self.assertTrue(await sockets[0].receive_nothing())
+
+                  for communicator in sockets:
+                        await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+                        await communicator.wait()
+                  self.assertEqual((await self.receive_json(watcher))["payload"], {"online": [], "offline": [mate.id]})
+                  self.assertEqual(await sync_to_async(presence.online)([self.user.id, mate.id]), {self.user.id})
+
+                  # A socket that stops sending heartbeats is swept and announced offline without a disconnect.
+                  with mock.patch.object(presence, "ttl", 0.1):
+                        silent, _ = await self.connect("/ws/notifications/present_mate/", "", mate)
+                        self.assertEqual((await self.receive_json(watcher))["payload"], {"online": [mate.id], "offline": []})
+                        event = await self.receive_json(watcher, timeout=2)
+                        self.assertEqual(event["payload"], {"online": [], "offline": [mate.id]})
+                        await silent.send_input({"type": "websocket.disconnect", "code": 1000})
+                        await silent.wait()
+
+                  await watcher.send_input({"type": "websocket.disconnect", "code": 1000})
+                  await watcher.wait()
+
+
+      async def test_other_users_sockets_are_refused(self):
+            communicator, connected = await self.connect("/ws/notifications/replayed/", "last_seen=0", AnonymousUser())
+            self.assertFalse(connected)
+
+
+
+      async def test_streams_are_multiplexed_over_one_socket(self):
+            team = await sync_to_async(Team.objects.create)(name="streamed_team")
+            await sync_to_async(team.members.add)(self.user)
+            other_team = await sync_to_async(Team.objects.create)(name="other_streamed_team")
+
+            communicator, connected = await self.connect("/ws/stream/", "", self.user)
+            self.assertTrue(connected)
+            self.assertEqual(await self.receive_json(communicator), {"type": "subscribed", "stream": "team", "team_id": team.id})
+
+            async def request(message):
+                  await communicator.send_input({"type": "websocket.receive", "text": json.dumps(message)})
+                  return await self.receive_json(communicator)
+
+            self.assertEqual((await request({"action": "subscribe", "stream": "team", "team_id": other_team.id}))["type"], "error")
+            self.assertEqual((await request({"action": "subscribe", "stream": "team", "team_id": team.id}))["type"], "subscribed")
+            self.assertEqual((await request({"action": "subscribe", "stream": "notifications", "last_seen": self.ids[-2]}))["type"], "subscribed")
+            self.assertEqual((await self.receive_json(communicator))["payload"]["id"], self.ids[-1])
+            self.assertTrue((await self.receive_json(communicator))["payload"]["replay_complete"])
+
+            await sync_to_async(Task.objects.create)(title="streamed", description="", deadline=timezone.now(), team=team,
+                                                     created_by=self.user, task_type="TESTING")
+            # The task event, the creator's notification and the creator's new unread count.
+            events = [await self.receive_json(communicator) for _ in range(3)]
+            self.assertEqual(sorted(event["stream"] for event in events), ["notifications", "notifications", "team"])
+            task_event = next(event for event in events if event["stream"] == "team")
+            self.assertEqual(task_event["payload"]["event"], "task_created")
+
+            self.assertEqual((await request({"action": "unsubscribe", "stream": "team", "team_id": team.id}))["type"], "unsubscribed")
+            await sync_to_async(Task.objects.create)(title="unseen", description="", deadline=timezone.now(), team=team,
+                                                     created_by=self.user, task_type="TESTING")
+            events = [await self.receive_json(communicator) for _ in range(2)]
+            self.assertEqual([event["stream"] for event in events], ["notifications", "notifications"])
+            self.assertTrue(await communicator.receive_nothing())
+            await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+            await communicator.wait()
+
+
+
+      async def test_team_sockets_follow_membership_changes(self):
+            team = await sync_to_async(Team.objects.create)(name="broadcast_team", leader=self.user)
+            await sync_to_async(team.members.add)(self.user)
+            newcomer = await sync_to_async(User.objects.create)(username="newcomer", email="newcomer@gmail.com", type="DOER", skills="Python")
+
+            member_socket, _ = await self.connect("/ws/stream/", "", self.user)
+            newcomer_socket, _ = await self.connect("/ws/notifications/newcomer/", "", newcomer)
+            self.assertEqual((await self.receive_json(member_socket))["team_id"], team.id)
+
+            await sync_to_async(team.add_member)(newcomer)
+            joined = await self.receive_json(member_socket)
+            self.assertEqual(joined["payload"]["event"], "members_joined")
+            self.assertEqual(joined["payload"]["members"], [{"id": newcomer.id, "username": "newcomer"}])
+
+            # The newcomer's socket joined the team's group, one group_send reaches both members.
+            task = await sync_to_async(Task.objects.create)(title="shared", description="", deadline=timezone.now(), team=team,
+                                                            created_by=self.user, task_type="TESTING")
+            await sync_to_async(task.renew_deadline)(2)
+            self.assertEqual([(await self.receive_json(newcomer_socket))["event"] for _ in range(2)], ["task_created", "deadline_renewed"])
+
+            await sync_to_async(team.remove_member)(newcomer)
+            self.assertEqual((await self.receive_json(newcomer_socket))["event"], "members_left")
+            self.assertIn("unread_count", await self.receive_json(newcomer_socket))
+            await sync_to_async(Task.objects.create)(title="unseen", description="", deadline=timezone.now(), team=team,
+                                                     created_by=self.user, task_type="TESTING")
+            self.assertTrue(await newcomer_socket.receive_nothing())
+
+            for communicator in (member_socket, newcomer_socket):
+                  await communicator.send_input({"type": "websocket.disconnect", "code": 1000})
+                  await communicator.wait()
+
+
+
+class TaskEventTests(TestCase):
+      def setUp(self):
+            self.user = User.objects.create(username="tasker", email="tasker@gmail.com", type="DOER", skills="Python")
+            self.team = Team.objects.create(name="task_team")
+            self.task = Task.objects.create(title="events", description="", deadline=timezone.now(), team=self.team,
+                                            created_by=self.user, task_type="TESTING")
+
+
+      def published_events(self, change):
+            with mock.patch("main.signals.publish") as publish:
+                  change()
+            return [(call.args[2]["event"], call.args[2].get("message")) for call in publish.call_args_list]
+
+
+      def test_only_changes_of_the_task_are_announced(self):
+            self.assertEqual(self.published_events(self.task.save), [])
+            self.assertEqual(self.published_events(lambda: self.task.save(update_fields=["status"])), [])
+
+            self.task.status = "COMPLETED"
+            self.assertEqual(self.published_events(self.task.save), [("task_completed", "Task 'events' completed!")])
+
+            self.task.title = "renamed"
+            self.assertEqual(self.published_events(self.task.save), [("task_updated", "Task 'renamed' updated!")])
+
+
+      def test_deletions_are_announced_with_a_message(self):
+            self.assertEqual(self.published_events(self.task.delete), [("task_deleted", "Task 'events' deleted!")])
+
+
+
+class RecordingChannelLayer:
+      def __init__(self):
+            self.sent = []
+
+      async def group_send(self, group_name, event):
+            self.sent.append((group_name, event))
+
+
+
+class PushQueueTests(TestCase):
+      def setUp(self):
+            self.layer = RecordingChannelLayer()
+            self.enterContext(mock.patch("main.push.get_channel_layer", return_value=self.layer))
+
+
+      def wait_until_sent(self, queue, count):
+            deadline = time.monotonic() + 2
+            while queue.stats()["sent_events"] < count and time.monotonic() < deadline:
+                  time.sleep(0.005)
+
+
+      def test_pushes_to_a_group_within_the_window_are_batched(self):
+            queue = PushQueue(window=0.05, max_batch=2)
+            events = [{"type": "send_unread_count", "count": count} for count in range(3)]
+            for event in events:
+                  queue.enqueue("notifications_a", event)
+            queue.enqueue("notifications_b", events[0])
+            self.assertEqual(queue.stats()["depth"], 4)
+
+            self.wait_until_sent(queue, 4)
+            self.assertCountEqual(self.layer.sent, [
+                  ("notifications_a", {"type": "push_batch", "events": events[:2]}),
+                  ("notifications_a", events[2]),
+                  ("notifications_b", events[0]),
+            ])
+            stats = queue.stats()
+            self.assertEqual((stats["depth"], stats["max_depth"], stats["sent_events"], stats["sent_messages"]), (0, 4, 4, 3))
+            self.assertGreater(stats["max_latency"], 0)
+
+
+      def test_queued_pushes_are_sent_on_close(self):
+            queue = PushQueue(window=60)
+            queue.enqueue("notifications_a", {"type": "send_unread_count", "count": 1})
+            queue.close()
+            self.assertEqual(self.layer.sent, [("notifications_a", {"type": "send_unread_count", "count": 1})])
+            self.assertEqual(queue.stats()["depth"], 0)
+
+
+      def test_pushes_wait_for_the_transaction_to_commit(self):
+            queue = PushQueue(window=0)
+            with self.captureOnCommitCallbacks(execute=True):
+                  queue.push("notifications_a", {"type": "send_unread_count", "count": 1})
+                  self.assertEqual(self.layer.sent, [])
+            self.assertEqual(self.layer.sent, [("notifications_a", {"type": "send_unread_count", "count": 1})])
+
+            with self.captureOnCommitCallbacks(execute=True):
+                  try:
+                        with transaction.atomic():
+                              queue.push("notifications_a", {"type": "send_unread_count", "count": 2})
+                              raise IntegrityError
+                  except IntegrityError:
+                        pass
+            self.assertEqual(len(self.layer.sent), 1)
+
+
+
+class PresenceTests(TestCase):
+      def setUp(self):
+            self.store = MemoryPresence()
+            self.enterContext(mock.patch.object(presence, "_store", self.store))
+
+
+      def test_users_are_online_until_their_last_connection_leaves_or_expires(self):
+            self.assertTrue(self.store.touch(1, "first", ttl=60))
+            self.assertFalse(self.store.touch(1, "second", ttl=60))
+            self.assertFalse(self.store.leave(1, "first"))
+            self.assertEqual(self.store.online([1, 2]), {1})
+            self.assertTrue(self.store.leave(1, "second"))
+
+            self.store.touch(2, "silent", ttl=60)
+            with mock.patch("main.presence.time.monotonic", return_value=time.monotonic() + 61):
+                  self.assertEqual(self.store.online([1, 2]), set())
+                  self.assertTrue(self.store.touch(2, "silent", ttl=60))
+
+
+      def test_expired_users_are_swept_once(self):
+            self.store.touch(1, "dropped", ttl=60)
+            self.store.touch(2, "alive", ttl=120)
+            self.assertEqual(self.store.expired(), [])
+            with mock.patch("main.presence.time.monotonic", return_value=time.monotonic() + 61):
+                  self.assertEqual(self.store.expired(), [1])
+                  self.assertEqual(self.store.expired(), [])
+            self.assertFalse(self.store.leave(1, "dropped"))
+
+
+      async def test_changes_are_sent_once_per_team_and_interval(self):
+            layer = RecordingChannelLayer()
+            tracker = Presence(interval=0.01)
+            with mock.patch("main.presence.get_channel_layer", return_value=layer):
+                  tracker.announce(1, [10, 11], online=True)
+                  tracker.announce(2, [10], online=True)
+                  tracker.announce(2, [10], online=False)
+                  await asyncio.sleep(0.05)
+
+            self.assertCountEqual([(group_name, event["payload"]) for group_name, event in layer.sent], [
+                  ("presence_10", {"online": [1], "offline": [2]}),
+                  ("presence_11", {"online": [1], "offline": []}),
+            ])
+
+
+      def test_online_teammates_are_listed(self):
+            user = User.objects.create(username="online_a", email="online_a@gmail.com", type="DOER", skills="Python")
+            mates = [User.objects.create(username=f"online_{name}", email=f"online_{name}@gmail.com", type="DOER", skills="Python")
+                     for name in ("b", "c")]
+            stranger = User.objects.create(username="online_d", email="online_d@gmail.com", type="DOER", skills="Python")
+            Team.objects.create(name="online_team").members.add(user, *mates)
+            for online_user in (mates[0], stranger):
+                  presence.touch(online_user.id, f"socket_{online_user.id}")
+
+            self.client.force_login(user)
+            response = self.client.get("/api/users/online_teammates/")
+            self.assertEqual([teammate["username"] for teammate in response.json()["online"]], ["online_b"])
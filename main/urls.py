@@ -14,7 +14,9 @@ from rest_framework.routers import DefaultRouter
 
 from .interfaces import (
     InvitationViewSet, UserViewSet, TaskViewSet, NotificationViewSet,
-    TeamViewSet, ToggleAvailabilityAPIView, ExtendDeadlineAPIView
+    TeamViewSet, ToggleAvailabilityAPIView, ExtendDeadlineAPIView,
+    PredictUserTypesAPIView, BulkRatingAPIView, UserLeaderboardAPIView,
+    TeamLeaderboardAPIView
 )
 
 
@@ -46,4 +48,8 @@ urlpatterns = [
     path('api/', include(router.urls)),
     path('api/user/', ToggleAvailabilityAPIView.as_view()),
     path('api/extend_deadline/<int:pk>/', ExtendDeadlineAPIView.as_view()),
+    path('api/predict_types/', PredictUserTypesAPIView.as_view()),
+    path('api/ratings/', BulkRatingAPIView.as_view()),
+    path('api/leaderboards/users/', UserLeaderboardAPIView.as_view()),
+    path('api/leaderboards/teams/', TeamLeaderboardAPIView.as_view()),
 ]
@@ -1,20 +1,27 @@
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
 from django.contrib import messages 
 from django.apps import apps
+from django.conf import settings
 
+from .push import push_queue
 
 
 
-def push_notification(username, message):
+
+def push_notification(username, message, notification_id=None, created_at=None):
     """
     This method pushes a real-time notification to a specific user via django channels.
-    "async_to_sync" wraps an async function so it can be called synchronously,
-    returning the async function's result.
+    It is queued on the push queue, which sends it after the transaction commits without blocking the caller.
+    The notification's id lets a reconnecting client skip notifications it already got.
     """
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(f'notifications_{username}',
-                                            {'type': 'send_notification', 'message': message})
+    push_queue.push(f'notifications_{username}',
+                    {'type': 'send_notification', 'message': message, 'id': notification_id,
+                     'created_at': created_at.isoformat() if created_at else None})
+
+
+
+def push_unread_count(username, count):
+    """This function pushes a user's new unread notification count to the user's websocket."""
+    push_queue.push(f'notifications_{username}', {'type': 'send_unread_count', 'count': count})
 
 
 
@@ -75,3 +82,28 @@ def get_notification_model():
      """
      return apps.get_model('main', 'Notification')
 
+
+
+
+_redis_client = None
+
+def get_redis_client():
+     """
+     This function returns a redis client for the Redis server of the channel layer,
+     or None when the channel layer doesn't use Redis (tests, local development).
+     """
+     global _redis_client
+     layer = settings.CHANNEL_LAYERS.get("default", {})
+     if not layer.get("BACKEND", "").startswith("channels_redis."):
+          return None
+     if _redis_client is None:
+          import redis
+
+          host = layer.get("CONFIG", {}).get("hosts", [("127.0.0.1", 6379)])[0]
+          if isinstance(host, dict):
+               host = host["address"]
+          if isinstance(host, str):
+               _redis_client = redis.Redis.from_url(host)
+          else:
+               _redis_client = redis.Redis(host=host[0], port=host[1])
+     return _redis_client
@@ -9,19 +9,22 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages 
 from django.urls import reverse_lazy, reverse
 from django.shortcuts import redirect
-from django.core.cache import caches
+from django.core.cache import cache
 from django.core.mail import send_mail
 from django.db import transaction, IntegrityError
 from .models import Task, Team, User, Invitation, Notification, TeamRating, UserRating, LeaderShipInvitation
 from .forms import MyLoginForm, MySignUpForm, TeamForm, TaskForm, ResetPasswordForm, DeleteUserAccountForm
 from .utils import handle_form, handle_invitation
+from .notifications import notify
+from .pagination import keyset_page
+from .search import SEARCH_LIMIT
+from .ratings import lock_rater
 
 
 
 
 User = get_user_model()
 
-cache = caches["default"]
 
 
 
@@ -73,7 +76,7 @@ class ResetPasswordView(FormView):
         form = ResetPasswordForm(request.POST)
         if form.is_valid():
             user.set_password(password)
-            user.save()
+            user.save(update_fields=["password"])
             messages.success(request, "Password Changed!")
             return redirect("reset_password")
         
@@ -181,6 +184,8 @@ class DashboardView(LoginRequiredMixin, DetailView):
         context = super().get_context_data(**kwargs)
         context["team_form"] = TeamForm()
         context["task_form"] = TaskForm(user_led_teams=Team.objects.filter(leader=self.object))
+        # The notifications socket asks for everything after this one when it reconnects.
+        context["last_notification_id"] = self.object.notifications.order_by("-id").values_list("id", flat=True).first()
         return context
     
     def post(self, request):
@@ -242,7 +247,7 @@ class DashboardView(LoginRequiredMixin, DetailView):
                 LeaderShipInvitation.objects.create(team=result, invited_user=invited_leader_id, invited_by=request.user)
                 
 
-            Notification.objects.create(user=request.user, message=f"New Team {result.name} Created!")
+            notify(request.user, f"New Team {result.name} Created!")
             return redirect('dashboard')
         
         if "upload_avatar" in request.POST:
@@ -253,7 +258,7 @@ class DashboardView(LoginRequiredMixin, DetailView):
 
             user = self.get_object()
             user.avatar = avatar
-            user.save()
+            user.save(update_fields=["avatar"])
 
             return redirect('dashboard')
 
@@ -357,6 +362,7 @@ class TeamListView(LoginRequiredMixin, ListView):
         
         try:
             with transaction.atomic():
+                lock_rater(user)
                 TeamRating.objects.create(user=user, team=team_obj, rating=new_score)        
                 team_obj.recalculate_teamwork_score(new_score)
                 
@@ -377,7 +383,7 @@ class TeamDetailsView(LoginRequiredMixin, DetailView):
         context = super().get_context_data(**kwargs)
         query = self.request.GET.get('search_query')
         if query:
-            context['users'] = User.objects.filter(username__icontains=query)
+            context['users'] = User.objects.search(query)[:SEARCH_LIMIT]
         else:
             context['users'] = User.objects.none()
         return context
@@ -407,7 +413,6 @@ class TeamDetailsView(LoginRequiredMixin, DetailView):
 
         elif action == "remove" and user == team_leader and selected_user_obj:
             team_obj.remove_member(selected_user_obj)
-            team_obj.save()
             return redirect('team_details', pk=team_id)
         
         messages.error(request, "User not found!")
@@ -436,15 +441,9 @@ class UsersRatingList(LoginRequiredMixin, ListView):
             messages.error(request, "User not found!")
             return redirect('ratings')
         
-        rated_user_teams = Team.objects.filter(members=rated_user)
-        user_teams = Team.objects.filter(members=user)
-
-        if not user_teams or not rated_user_teams:
-            messages.error(request, "Both users must be a team member!")
-            return redirect('ratings')
-
-        if new_score and rated_user and rated_user_teams.intersection(user_teams).exists():
+        if new_score and rated_user and User.objects.are_teammates(user, rated_user):
             with transaction.atomic():
+                lock_rater(user)
                 try:
                     UserRating.objects.create(rater=user, rated=rated_user, rating=new_score)
                     rated_user.score = rated_user.calculate_new_score(int(new_score))
@@ -462,10 +461,19 @@ class NotificationsView(LoginRequiredMixin, ListView):
     model = Notification
     template_name = "main/notifications.html"
     context_object_name = "notifications"
-    paginate_by = 10
+    page_size = 10
 
     def get_queryset(self):
         user = self.request.user
-        notifications = Notification.objects.filter(user=user).order_by('-created_at')
+        notifications = Notification.objects.filter(user=user).order_by('-created_at', '-id')
         return notifications
 
+    def get_context_data(self, **kwargs):
+        # Keyset pagination: the page is looked up from the cursor of its neighbour, with no OFFSET or COUNT.
+        notifications, next_cursor, previous_cursor = keyset_page(
+            self.object_list, self.page_size,
+            after=self.request.GET.get("after"), before=self.request.GET.get("before"),
+        )
+        kwargs.update(next_cursor=next_cursor, previous_cursor=previous_cursor)
+        return super().get_context_data(object_list=notifications, **kwargs)
+
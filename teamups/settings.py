@@ -82,6 +82,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'main.notifications.NotificationBatchMiddleware',
 ]
 
 ROOT_URLCONF = 'teamups.urls'
@@ -108,11 +109,13 @@ ASGI_APPLICATION = 'teamups.asgi.application'
 
 
 
+REDIS_HOST = env("REDIS_HOST", default="127.0.0.1") # Added REDIS_HOST for docker compose
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            "hosts": [(env("REDIS_HOST", default="127.0.0.1"), 6379)], # Added REDIS_HOST for docker compose
+            "hosts": [(REDIS_HOST, 6379)],
         },
     },
 }
@@ -120,6 +123,70 @@ CHANNEL_LAYERS = {
 
 
 
+# Matchmaker model loading
+"""
+PRELOAD loads the model in MainConfig.ready() (use it with "gunicorn --preload" so forked
+workers share the memory-mapped arrays), otherwise it is loaded on the first prediction.
+Every RELOAD_INTERVAL seconds workers check whether "manage.py train_matchmaker" activated a new model.
+Predictions run on an EXECUTOR ("thread" or "process") pool of WORKERS; past MAX_QUEUE pending predictions
+or after TIMEOUT seconds, signup asks the user to pick a type.
+"""
+MATCHMAKER = {
+    "PRELOAD": env.bool("MATCHMAKER_PRELOAD", default=False),
+    "MMAP_MODE": "r",
+    "CACHE_SIZE": env.int("MATCHMAKER_CACHE_SIZE", default=1024),
+    "RELOAD_INTERVAL": env.float("MATCHMAKER_RELOAD_INTERVAL", default=5.0),
+    "EXECUTOR": env("MATCHMAKER_EXECUTOR", default="thread"),
+    "WORKERS": env.int("MATCHMAKER_WORKERS", default=2),
+    "MAX_QUEUE": env.int("MATCHMAKER_MAX_QUEUE", default=32),
+    "TIMEOUT": env.float("MATCHMAKER_TIMEOUT", default=2.0),
+}
+
+
+
+# Notification retention
+"""
+"manage.py prune_notifications" deletes (or archives, with --archive) read notifications
+older than RETENTION_DAYS, PRUNE_BATCH_SIZE primary keys at a time.
+"""
+NOTIFICATIONS = {
+    "RETENTION_DAYS": env.int("NOTIFICATIONS_RETENTION_DAYS", default=90),
+    "PRUNE_BATCH_SIZE": env.int("NOTIFICATIONS_PRUNE_BATCH_SIZE", default=1000),
+}
+
+
+
+# Websocket pushes
+"""
+Pushes are sent after their transaction commits from a background event loop. The pushes to one group
+within WINDOW seconds are sent as one batch of at most MAX_BATCH events, WINDOW = 0 sends each one right away.
+"""
+PUSH = {
+    "WINDOW": env.float("PUSH_WINDOW", default=0.05),
+    "MAX_BATCH": env.int("PUSH_MAX_BATCH", default=50),
+}
+
+
+# Websocket presence
+"""
+A user is online while one of their websockets sent a heartbeat in the last TTL seconds.
+Users going online or offline are announced to their teams at most every INTERVAL seconds.
+"""
+PRESENCE = {
+    "TTL": env.int("PRESENCE_TTL", default=60),
+    "INTERVAL": env.float("PRESENCE_INTERVAL", default=5.0),
+}
+
+"""
+The rankings share the channel layer's Redis, their sorted sets are named KEY_PREFIX:<ranking>.
+"""
+LEADERBOARDS = {
+    "KEY_PREFIX": env("LEADERBOARDS_KEY_PREFIX", default="teamups:leaderboard"),
+}
+
+
+
+
 # HACK: Temporary workaround to switch databases
 DATABASES = {
     # 'default': {
@@ -146,11 +213,12 @@ DATABASES = {
 
 
 
+# The teammate sets and search prefixes are cached here and invalidated by every worker,
+# so the cache has to be shared: it lives in database 1 of the channel layer's Redis.
 CACHES = {
     "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": "redis://127.0.0.1:6379/1",
-        "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"redis://{REDIS_HOST}:6379/1",
     },
 }
 